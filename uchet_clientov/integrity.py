@@ -0,0 +1,47 @@
+"""Orphan check for the shop database: rows that point to a deleted user,
+client or product. Read-only unless --repair is given: the check also works
+on a database the app has not migrated yet and reports what a repair would
+remove.
+
+    python integrity.py --db kursach.db
+    python integrity.py --db kursach.db --repair
+
+Repairs delete orphaned client cards, orders and purchases, and clear
+product_id on purchases of deleted products; each fix is written to the
+audit log as "repair_orphans". Safe to run from cron while terminals are
+working: every id range is checked in its own short transaction.
+"""
+import argparse
+import os
+import sys
+
+from storage import INTEGRITY_BATCH_ROWS, ORPHAN_CHECKS, open_storage
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default=os.environ.get("UCHET_DB_URL", "kursach.db"),
+                        help="путь к SQLite-файлу или postgresql:// URL")
+    parser.add_argument("--repair", action="store_true", help="исправить найденное")
+    parser.add_argument("--batch", type=int, default=INTEGRITY_BATCH_ROWS, help="строк на транзакцию")
+    args = parser.parse_args(argv)
+
+    storage = open_storage(args.db, pool_size=1)
+    try:
+        if args.repair:
+            storage.ensure_schema()
+        found = storage.check_integrity(repair=args.repair, batch_rows=args.batch)
+    finally:
+        storage.close()
+
+    for key, description, *_ in ORPHAN_CHECKS:
+        print(f"{description}: {found[key]}")
+    total = sum(found.values())
+    if args.repair:
+        print(f"исправлено строк: {total}")
+        return 0
+    return 1 if total else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
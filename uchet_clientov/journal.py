@@ -0,0 +1,269 @@
+"""Offline journal for a shop terminal: a local SQLite file that keeps the
+terminal selling while the central database is unreachable.
+
+Purchases and registrations made offline are committed here and replayed to
+the central database by sync() in batches of SYNC_BATCH_SIZE, oldest first,
+one central transaction per batch. Every entry carries a random op id; the
+central side remembers applied ids (Storage.apply_offline_batch), so a batch
+whose reply was lost is safe to send again.
+
+The journal also remembers, for this terminal only, the sessions of users
+who logged in online (password kept as a salted PBKDF2 hash) and the last
+catalog seen, so a terminal started during an outage can still log those
+users in and show products.
+
+A registration has to carry its password until it reaches the central
+database; once synced the password is removed from the entry, and synced
+entries are pruned after JOURNAL_RETENTION_DAYS.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from storage import Session, StorageBusy, StorageUnavailable
+
+
+SYNC_BATCH_SIZE = 200
+PASSWORD_HASH_ROUNDS = 100_000
+# Synced entries are kept this long for troubleshooting, then pruned
+JOURNAL_RETENTION_DAYS = 30
+
+
+def new_op_id():
+    """Random id of one terminal operation, unique across terminals."""
+    return uuid.uuid4().hex
+
+
+def _hash_password(password, salt):
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, PASSWORD_HASH_ROUNDS).hex()
+
+
+class OfflineJournal:
+    """Local write queue plus login and catalog snapshots for one terminal."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Throughput of the last sync() that sent anything, entries per second
+        self.last_rate = 0.0
+        self.synced_total = 0
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op_id TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    message TEXT,
+                    synced_at TEXT
+                )
+            """)
+            # Only pending rows are indexed: depth and the next batch never
+            # walk the history of already synced entries
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_pending ON queue(id) WHERE status = 'pending'")
+            # Journals written before passwords were scrubbed on sync
+            self._conn.execute("""
+                UPDATE queue SET payload = json_remove(payload, '$.password')
+                WHERE status != 'pending' AND kind = 'register'
+                  AND json_extract(payload, '$.password') IS NOT NULL
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    username TEXT PRIMARY KEY,
+                    salt BLOB NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    client_id INTEGER,
+                    role TEXT
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS catalog (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT,
+                    price_kop INTEGER,
+                    quantity INTEGER,
+                    reorder_threshold INTEGER
+                )
+            """)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- queue ---
+
+    def _enqueue(self, kind, payload, op_id=None):
+        payload["queued_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO queue (op_id, kind, payload) VALUES (?, ?, ?)",
+                (op_id or new_op_id(), kind, json.dumps(payload, ensure_ascii=False))
+            )
+
+    def queue_purchase(self, session, product, quantity, op_id=None):
+        """Records a purchase of `product` (a catalog Product) at the price
+        shown. Pass the `op_id` of an online attempt that may have gone
+        through, so the central side applies the sale at most once."""
+        self._enqueue("purchase", {
+            "user_id": session.user_id,
+            "client_id": session.client_id,
+            "username": session.username,
+            "product_id": product.id,
+            "quantity": quantity,
+            "price_kop": product.price_kop,
+        }, op_id)
+
+    def queue_registration(self, username, password, phone, email):
+        self._enqueue("register", {
+            "username": username,
+            "password": password,
+            "phone": phone,
+            "email": email,
+        })
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM queue WHERE status = 'pending'").fetchone()[0]
+
+    def pending_quantity(self, product_id):
+        """Units of `product_id` sold offline and not yet synced."""
+        with self._lock:
+            return self._conn.execute("""
+                SELECT COALESCE(SUM(json_extract(payload, '$.quantity')), 0)
+                FROM queue
+                WHERE status = 'pending' AND kind = 'purchase'
+                  AND json_extract(payload, '$.product_id') = ?
+            """, (product_id,)).fetchone()[0]
+
+    def _next_batch(self, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, op_id, kind, payload FROM queue WHERE status = 'pending' ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(row_id, op_id, kind, json.loads(payload)) for row_id, op_id, kind, payload in rows]
+
+    def _mark(self, batch, results):
+        synced_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            # The password is only needed until the central side has the user
+            self._conn.executemany("""
+                UPDATE queue SET status = ?, message = ?, synced_at = ?,
+                    payload = CASE WHEN kind = 'register' THEN json_remove(payload, '$.password') ELSE payload END
+                WHERE id = ?
+            """, [(status, message, synced_at, entry[0]) for entry, (status, message) in zip(batch, results)])
+
+    def prune(self, days=JOURNAL_RETENTION_DAYS):
+        """Deletes entries synced more than `days` ago. Returns how many."""
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM queue WHERE status != 'pending' AND synced_at < ?", (cutoff,)
+            ).rowcount
+
+    def sync(self, storage, batch_size=SYNC_BATCH_SIZE):
+        """Sends pending entries until the queue is empty. Returns a list of
+        (kind, payload, status, message) for entries that were not fully
+        applied. Raises StorageUnavailable if the database drops mid-way;
+        everything sent before that stays synced. A lock or serialization
+        conflict ends the pass early and leaves the rest pending for the
+        next sync()."""
+        problems = []
+        sent = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                batch = self._next_batch(batch_size)
+                if not batch:
+                    break
+                try:
+                    results = self._apply(storage, batch)
+                except StorageBusy:
+                    break
+                self._mark(batch, results)
+                sent += len(batch)
+                problems.extend(
+                    (kind, payload, status, message)
+                    for (_, _, kind, payload), (status, message) in zip(batch, results)
+                    if status != "done"
+                )
+        finally:
+            if sent:
+                self.synced_total += sent
+                self.last_rate = sent / max(time.perf_counter() - started, 1e-6)
+                self.prune()
+        return problems
+
+    def _apply(self, storage, batch):
+        entries = [(op_id, kind, payload) for _, op_id, kind, payload in batch]
+        try:
+            return storage.apply_offline_batch(entries)
+        except (StorageUnavailable, StorageBusy):
+            raise
+        except Exception as e:
+            # A constraint or payload error repeats on every retry
+            if len(batch) == 1:
+                return [("rejected", str(e))]
+        # Something in the batch fails on its own: replay one by one so a
+        # single bad entry is rejected instead of blocking the queue
+        results = []
+        for entry in batch:
+            results.extend(self._apply(storage, [entry]))
+        return results
+
+    # --- login and catalog snapshots ---
+
+    def remember_session(self, session, password):
+        salt = os.urandom(16)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (username, salt, password_hash, user_id, client_id, role) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session.username, salt, _hash_password(password, salt),
+                 session.user_id, session.client_id, session.role)
+            )
+
+    def cached_session(self, username, password):
+        """The Session saved at this user's last online login on this
+        terminal, or None for an unknown user or a wrong password."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT salt, password_hash, user_id, client_id, role FROM sessions WHERE username = ?",
+                (username,)
+            ).fetchone()
+        if not row or _hash_password(password, row[0]) != row[1]:
+            return None
+        return Session(row[2], row[3], username, row[4])
+
+    def save_catalog(self, products):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM catalog")
+            self._conn.executemany(
+                "INSERT INTO catalog (id, name, price_kop, quantity, reorder_threshold) VALUES (?, ?, ?, ?, ?)",
+                [(p.id, p.name, p.price_kop, p.quantity, p.reorder_threshold) for p in products]
+            )
+
+    def update_catalog(self, products):
+        """Saves only the given records, after a refresh that changed a few."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO catalog (id, name, price_kop, quantity, reorder_threshold) VALUES (?, ?, ?, ?, ?)",
+                [(p.id, p.name, p.price_kop, p.quantity, p.reorder_threshold) for p in products]
+            )
+
+    def load_catalog(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, name, price_kop, quantity, reorder_threshold FROM catalog ORDER BY id"
+            ).fetchall()
@@ -0,0 +1,356 @@
+"""Headless load test: N terminals hammering one database through the same
+Storage calls the windows use (login, buy_product, register, admin refresh).
+
+    python loadtest.py --db loadtest.db --reset --workers 8 --duration 20
+    python loadtest.py --db loadtest.db --workers 16 --mode process --mix buy=80,login=20
+
+Each worker is one terminal with its own connection. For SQLite the driver
+busy timeout is turned off and lock waits are retried here with backoff, up
+to --lock-timeout (the app's own 5 s by default), so the time spent waiting
+for the write lock is measured instead of hidden inside sqlite3. An
+operation that is still locked after that counts as a "database is locked"
+error, which is what a terminal would show.
+
+Never point --reset at the shop's real kursach.db: it adds test users and
+products.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from storage import CatalogCache, PurchaseError, SQLiteStorage, StorageBusy, open_storage
+
+
+DEFAULT_MIX = "login=30,buy=50,register=5,refresh=15"
+LOADTEST_PASSWORD = "pw"
+USER_PREFIX = "lt_user_"
+PRODUCT_PREFIX = "lt_product_"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"неизвестная операция: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def open_worker_storage(url):
+    # One connection per terminal, no hidden busy waiting
+    if url.startswith(("postgresql://", "postgres://")):
+        return open_storage(url, pool_size=1)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteStorage(url, pool_size=1, timeout=0)
+
+
+def is_lock_error(exc):
+    return isinstance(exc, StorageBusy)
+
+
+# --- operations: each takes (storage, state, rng) ---
+
+def op_login(storage, state, rng):
+    username = rng.choice(state["users"])
+    storage.authenticate(username, LOADTEST_PASSWORD)
+
+
+def op_buy(storage, state, rng):
+    # What UserWindow.buy_product does: refresh the catalog for the stock
+    # pre-check, buy with the session from login, refresh again to redraw
+    session = rng.choice(state["sessions"])
+    product_id = rng.choice(state["products"])
+    quantity = rng.randint(1, 3)
+    catalog = state["catalog"]
+    catalog.refresh()
+    if not catalog.has_stock(product_id, quantity):
+        raise PurchaseError("Недостаточно товара на складе.")
+    storage.buy_product(session, product_id, quantity)
+    catalog.refresh()
+
+
+def op_register(storage, state, rng):
+    state["registered"] += 1
+    username = f"{USER_PREFIX}w{state['worker']}_{state['registered']}_{state['run']}"
+    storage.register_user(username, LOADTEST_PASSWORD, "+70000000000", f"{username}@example.com")
+
+
+def op_refresh(storage, state, rng):
+    # What ClientApp.refresh_all plus the stock monitor read
+    storage.list_clients()
+    storage.list_products()
+    storage.list_orders()
+    storage.low_stock_products()
+
+
+OPERATIONS = {
+    "login": op_login,
+    "buy": op_buy,
+    "register": op_register,
+    "refresh": op_refresh,
+}
+
+
+def timed_call(fn, lock_timeout):
+    """Runs fn, retrying on lock errors. Returns (latency, lock_wait, outcome,
+    error) where outcome is "ok", "rejected" (PurchaseError), "locked" or
+    "error", and error is the text of the unexpected exception, if any."""
+    start = time.perf_counter()
+    lock_wait = 0.0
+    delay = 0.001
+    while True:
+        attempt_start = time.perf_counter()
+        try:
+            fn()
+            return time.perf_counter() - start, lock_wait, "ok", None
+        except PurchaseError:
+            return time.perf_counter() - start, lock_wait, "rejected", None
+        except Exception as e:
+            if not is_lock_error(e):
+                return time.perf_counter() - start, lock_wait, "error", f"{type(e).__name__}: {e}"
+            lock_wait += time.perf_counter() - attempt_start
+            if time.perf_counter() - start + delay > lock_timeout:
+                return time.perf_counter() - start, lock_wait, "locked", None
+            time.sleep(delay)
+            lock_wait += delay
+            delay = min(delay * 2, 0.05)
+
+
+def run_worker(worker, config):
+    """One terminal. Returns a list of (op, latency, lock_wait, outcome, error)."""
+    rng = random.Random(config["seed"] + worker)
+    storage = open_worker_storage(config["db"])
+    state = {
+        # Each terminal process has its own catalog cache
+        "catalog": CatalogCache(storage),
+        "worker": worker,
+        "run": config["run"],
+        "registered": 0,
+        "users": config["users"],
+        "sessions": config["sessions"],
+        "products": config["products"],
+    }
+    names = list(config["mix"])
+    weights = [config["mix"][n] for n in names]
+    think = config["think_ms"] / 1000
+    samples = []
+    deadline = time.perf_counter() + config["duration"]
+    try:
+        while time.perf_counter() < deadline:
+            op = rng.choices(names, weights)[0]
+            latency, lock_wait, outcome, error = timed_call(
+                lambda: OPERATIONS[op](storage, state, rng), config["lock_timeout"]
+            )
+            samples.append((op, latency, lock_wait, outcome, error))
+            if think:
+                time.sleep(rng.uniform(0, 2 * think))
+    finally:
+        storage.close()
+    return samples
+
+
+def _guarded_worker(worker, config):
+    """(samples, None), or (None, error text) if the terminal failed to run:
+    a failed worker must show up in the report, not hang or vanish."""
+    try:
+        return run_worker(worker, config), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _process_worker(worker, config, results):
+    results.put((worker,) + _guarded_worker(worker, config))
+
+
+def collect_process_results(procs, results):
+    """Yields (worker, samples, error) from worker processes. A process that
+    died without reporting (killed, crashed interpreter) is yielded with an
+    error instead of blocking the run forever."""
+    reported = set()
+    while len(reported) < len(procs):
+        try:
+            worker, samples, error = results.get(timeout=1.0)
+        except queue.Empty:
+            if any(p.is_alive() for p in procs):
+                continue
+            # Everyone has exited: whatever they sent is already readable
+            try:
+                worker, samples, error = results.get(timeout=1.0)
+            except queue.Empty:
+                for i, p in enumerate(procs):
+                    if i not in reported:
+                        yield i, None, f"процесс завершился без результата (код {p.exitcode})"
+                return
+        reported.add(worker)
+        yield worker, samples, error
+
+
+def seed_database(url, users, products, stock):
+    """Creates the load-test users and products if missing; returns their
+    names, login sessions, product ids and the stock each product starts
+    this run with."""
+    storage = open_storage(url, pool_size=1)
+    storage.ensure_schema()
+    storage.ensure_admin()
+    usernames = [f"{USER_PREFIX}{i}" for i in range(users)]
+    for username in usernames:
+        storage.register_user(username, LOADTEST_PASSWORD, "+70000000000", f"{username}@example.com")
+    sessions = [storage.authenticate(username, LOADTEST_PASSWORD) for username in usernames]
+    existing = {name: pid for pid, name, *_ in storage.list_products()}
+    for i in range(products):
+        name = f"{PRODUCT_PREFIX}{i}"
+        if name in existing:
+            storage.restock_product(existing[name], stock, "loadtest")
+        else:
+            storage.add_product(name, 10000, stock, "loadtest")
+    rows = [r for r in storage.list_products() if r[1].startswith(PRODUCT_PREFIX)]
+    product_ids = [r[0] for r in rows]
+    initial = {r[0]: r[3] for r in rows}
+    sold_before = dict(storage.fetchall(
+        "SELECT product_id, COUNT(*) FROM purchases GROUP BY product_id"
+    ))
+    storage.close()
+    return usernames, sessions, product_ids, initial, sold_before
+
+
+def check_oversell(url, initial, sold_before):
+    """Products whose stock went negative, or whose units sold during the run
+    do not match the stock taken: (id, start, sold, left)."""
+    storage = open_storage(url, pool_size=1)
+    left = {pid: qty for pid, _, _, qty, _ in storage.list_products()}
+    sold_after = dict(storage.fetchall(
+        "SELECT product_id, COUNT(*) FROM purchases GROUP BY product_id"
+    ))
+    storage.close()
+    violations = []
+    for pid, start in initial.items():
+        sold = sold_after.get(pid, 0) - sold_before.get(pid, 0)
+        remaining = left.get(pid, 0)
+        if remaining < 0 or sold > start or start - sold != remaining:
+            violations.append((pid, start, sold, remaining))
+    return violations
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def report(samples, elapsed, workers, violations, failed=(), out=sys.stdout):
+    print(f"== Нагрузочный тест: {workers} терминалов, {elapsed:.1f} с ==", file=out)
+    total = len(samples)
+    print(f"операций: {total}, пропускная способность: {total / elapsed:.1f} оп/с", file=out)
+    header = f"{'операция':<10}{'всего':>8}{'оп/с':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'max мс':>9}" \
+             f"{'ожид. мс':>10}{'отказ':>7}{'locked':>8}{'ошибки':>8}"
+    print(header, file=out)
+    for op in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == op]
+        latencies = sorted(s[1] * 1000 for s in rows)
+        lock_wait = sum(s[2] for s in rows) * 1000
+        outcomes = [s[3] for s in rows]
+        print(f"{op:<10}{len(rows):>8}{len(rows) / elapsed:>9.1f}"
+              f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}"
+              f"{percentile(latencies, 99):>9.1f}{latencies[-1]:>9.1f}"
+              f"{lock_wait:>10.0f}{outcomes.count('rejected'):>7}"
+              f"{outcomes.count('locked'):>8}{outcomes.count('error'):>8}", file=out)
+    first_errors = {}
+    for op, _, _, _, error in samples:
+        if error and op not in first_errors:
+            first_errors[op] = error
+    for op, error in sorted(first_errors.items()):
+        print(f"  первая ошибка {op}: {error}", file=out)
+    for worker, error in failed:
+        print(f"ТЕРМИНАЛ {worker} НЕ ОТРАБОТАЛ: {error}", file=out)
+    total_wait = sum(s[2] for s in samples)
+    locked = sum(1 for s in samples if s[3] == "locked")
+    print(f"ожидание блокировки: всего {total_wait:.2f} с, "
+          f"{total_wait / max(total, 1) * 1000:.2f} мс на операцию", file=out)
+    print(f"ошибок 'database is locked': {locked}", file=out)
+    if violations:
+        print(f"ПЕРЕПРОДАЖА: {len(violations)} товаров", file=out)
+        for pid, start, sold, remaining in violations[:20]:
+            print(f"  товар {pid}: было {start}, продано {sold}, осталось {remaining}", file=out)
+    else:
+        print("перепродаж нет", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="loadtest.db", help="путь к SQLite-файлу или postgresql:// URL")
+    parser.add_argument("--workers", type=int, default=4, help="число терминалов")
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на прогон")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--stock", type=int, default=200, help="пополнение каждого товара перед прогоном")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="средняя пауза между операциями")
+    parser.add_argument("--lock-timeout", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true", help="удалить SQLite-файл перед прогоном")
+    args = parser.parse_args(argv)
+
+    if args.reset and not args.db.startswith(("postgresql://", "postgres://")):
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    users, sessions, products, initial, sold_before = seed_database(args.db, args.users, args.products, args.stock)
+    config = {
+        "db": args.db,
+        "duration": args.duration,
+        "mix": args.mix,
+        "users": users,
+        "sessions": sessions,
+        "products": products,
+        "think_ms": args.think_ms,
+        "lock_timeout": args.lock_timeout,
+        "seed": args.seed,
+        "run": int(time.time()),
+    }
+
+    started = time.perf_counter()
+    samples, failed = [], []
+    if args.mode == "thread":
+        outcomes = [None] * args.workers
+
+        def target(i):
+            outcomes[i] = (i,) + _guarded_worker(i, config)
+
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(args.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_process_worker, args=(i, config, results))
+                 for i in range(args.workers)]
+        for p in procs:
+            p.start()
+        outcomes = list(collect_process_results(procs, results))
+        for p in procs:
+            p.join()
+    for worker, worker_samples, error in outcomes:
+        if error:
+            failed.append((worker, error))
+        samples.extend(worker_samples or [])
+    elapsed = time.perf_counter() - started
+
+    violations = check_oversell(args.db, initial, sold_before)
+    report(samples, elapsed, args.workers, violations, failed)
+    return 1 if violations or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,173 @@
+import time
+_STARTUP_T0 = time.perf_counter()
+
+import os
 import sys
-import sqlite3
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QMessageBox, QTableWidgetItem, QTableWidget,
-    QComboBox, QLineEdit, QPushButton, QWidget, QLabel
+    QComboBox, QLineEdit, QPushButton, QWidget, QLabel, QSpinBox
 )
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtCore import QFile
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer, QLocale, QEvent
 from PySide6.QtWidgets import QGraphicsDropShadowEffect
-from datetime import date, timedelta
+from storage import open_storage, CatalogCache, PurchaseError, StorageBusy, StorageError, StorageUnavailable
+from journal import OfflineJournal, new_op_id
+from money import parse_price
+
+_IMPORTS_DONE = time.perf_counter()
 
 
 DB_NAME = "kursach.db"
+# Storage URL: a SQLite file path (default) or postgresql://...
+DB_URL = os.environ.get("UCHET_DB_URL", DB_NAME)
+# This terminal's offline queue; must be on a local disk, not the shared one
+JOURNAL_PATH = os.environ.get("UCHET_JOURNAL", "terminal_journal.db")
 AUTH_UI = "auth_window.ui"
+PURCHASES_PAGE_SIZE = 50
+# Target time from process start to the login form being painted
+STARTUP_TARGET_MS = 400
+# How often ClientApp re-checks stock against reorder thresholds
+LOW_STOCK_CHECK_MS = 60_000
+# How often UserWindow tries to reach the database and send queued work
+SYNC_INTERVAL_MS = 5_000
+# Shown when another terminal held the database lock past the timeout;
+# nothing was written, so the action can simply be repeated
+BUSY_MESSAGE = "База занята другими терминалами, повторите попытку."
+
+AUDIT_ACTION_TITLES = {
+    "add_client": "Добавлен клиент",
+    "delete_client": "Удалён клиент",
+    "change_password": "Смена пароля",
+    "add_product": "Добавлен товар",
+    "delete_product": "Удалён товар",
+    "add_order": "Добавлен заказ",
+    "delete_order": "Удалён заказ",
+    "buy_product": "Покупка",
+    "restock": "Пополнение",
+    "set_threshold": "Изменён порог",
+    "repair_orphans": "Исправлены висячие ссылки",
+    "price_unparsed": "Цена не распознана",
+}
+
+_storage = None
+_catalog = None
+_journal = None
+_maintenance_done = False
+
+
+class StartupProfile:
+    """Collects per-phase timings for --profile-startup."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = [("импорт модулей", _IMPORTS_DONE - _STARTUP_T0)]
+        self.login_form_at = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def mark_login_form(self):
+        self.login_form_at = time.perf_counter()
+
+    def report(self, out=sys.stderr):
+        if not self.enabled:
+            return
+        print("== Профиль запуска ==", file=out)
+        for name, seconds in self.phases:
+            print(f"  {name:<32} {seconds * 1000:8.1f} мс", file=out)
+        if self.login_form_at is not None:
+            to_form = (self.login_form_at - _STARTUP_T0) * 1000
+            verdict = "OK" if to_form <= STARTUP_TARGET_MS else "превышено"
+            print(f"  время до формы входа: {to_form:.1f} мс "
+                  f"(цель {STARTUP_TARGET_MS} мс, {verdict})", file=out)
+        print("== Импорты (-X importtime, топ по cumulative) ==", file=out)
+        for name, self_us, cumulative_us in profile_imports():
+            print(f"  {cumulative_us / 1000:8.1f} мс  (self {self_us / 1000:6.1f})  {name}", file=out)
+
+
+startup_profile = StartupProfile()
+
+
+def profile_imports(limit=15):
+    """Re-imports this module under -X importtime and returns the top-level
+    imports sorted by cumulative time as (name, self_us, cumulative_us)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=here, capture_output=True, text=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        # Nested imports are indented under their parent; keep top-level only
+        if name.startswith("  "):
+            continue
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    entries.sort(key=lambda e: e[2], reverse=True)
+    return entries[:limit]
+
+
+def get_storage():
+    """Process-wide storage backend, opened on first use."""
+    global _storage
+    if _storage is None:
+        _storage = open_storage(DB_URL)
+    return _storage
+
+
+def get_catalog():
+    """Process-wide product catalog cache shared by all windows."""
+    global _catalog
+    if _catalog is None:
+        _catalog = CatalogCache(get_storage())
+    return _catalog
+
+
+def get_journal():
+    """This terminal's offline journal, opened on first use."""
+    global _journal
+    if _journal is None:
+        _journal = OfflineJournal(JOURNAL_PATH)
+    return _journal
+
+
+def ensure_schema():
+    get_storage().ensure_schema()
+
+
+def run_startup_maintenance():
+    """Schema, expired-order purge and admin check, deferred until after the
+    login form is on screen. Safe to call repeatedly."""
+    global _maintenance_done
+    if _maintenance_done:
+        return
+    with startup_profile.phase("подключение к БД"):
+        storage = get_storage()
+    with startup_profile.phase("схема БД"):
+        storage.ensure_schema()
+    with startup_profile.phase("очистка просроченных заказов"):
+        try:
+            storage.cleanup_expired_orders()
+        except Exception:
+            pass
+    with startup_profile.phase("проверка admin"):
+        storage.ensure_admin()
+    _maintenance_done = True
 
 
 def build_stylesheet_dark() -> str:
@@ -103,6 +258,21 @@ def build_stylesheet_dark() -> str:
     """
 
 
+# Prices are kept in kopecks; the locale only affects how they are shown
+_price_locale = QLocale(QLocale.Russian, QLocale.Russia)
+
+
+@lru_cache(maxsize=4096)
+def format_price(price_kop):
+    """Kopecks -> "1 299,90 ₽" in the price locale. Cached: a catalog has few
+    distinct prices, and tables are re-rendered after every change."""
+    if price_kop is None:
+        return ""
+    sign = "-" if price_kop < 0 else ""
+    rubles, kopecks = divmod(abs(price_kop), 100)
+    return f"{sign}{_price_locale.toString(rubles)}{_price_locale.decimalPoint()}{kopecks:02d} ₽"
+
+
 def apply_shadows(widgets):
     for w in widgets:
         if not w:
@@ -117,9 +287,9 @@ def apply_shadows(widgets):
             pass
 
 class UserWindow(QMainWindow):
-    def __init__(self, username):
+    def __init__(self, session):
         super().__init__()
-        self.username = username
+        self.session = session
         loader = QUiLoader()
         ui_file = QFile("user_page.ui")
         if not ui_file.open(QFile.ReadOnly):
@@ -154,7 +324,6 @@ class UserWindow(QMainWindow):
         self.btnBuy = self.ui_root.findChild(QPushButton, "btnBuy")
         self.labelMessage = self.ui_root.findChild(QLabel, "labelMessage")
         # Buy quantity spinbox from user_page.ui
-        from PySide6.QtWidgets import QSpinBox
         self.inputBuyQuantityUser = self.ui_root.findChild(QSpinBox, "inputBuyQuantityUser")
 
         # Add logout button for user window
@@ -165,9 +334,19 @@ class UserWindow(QMainWindow):
         # Add clients table for user window (if present in UI)
         self.tableClients = self.ui_root.findChild(QTableWidget, "tableClients")
 
+        self.btnMyPurchases = self.ui_root.findChild(QPushButton, "btnMyPurchases")
+        if self.btnMyPurchases:
+            self.btnMyPurchases.clicked.connect(self.open_purchases)
+
         if self.btnBuy:
             self.btnBuy.clicked.connect(self.buy_product)
 
+        self.labelSync = self.ui_root.findChild(QLabel, "labelSync")
+
+        self.rendered_generation = None
+        # True while the database is unreachable; purchases go to the journal
+        self.offline = False
+
         self.init_menu_and_theme()
         self.init_db()
         # Load clients before showing the window
@@ -178,6 +357,15 @@ class UserWindow(QMainWindow):
         except Exception:
             pass
         self.show()
+        self.update_sync_status()
+
+        self.syncTimer = QTimer(self)
+        self.syncTimer.timeout.connect(self.sync_journal)
+        self.syncTimer.start(SYNC_INTERVAL_MS)
+
+    def closeEvent(self, event):
+        self.syncTimer.stop()
+        super().closeEvent(event)
 
     def init_menu_and_theme(self):
         self.apply_theme()
@@ -191,90 +379,74 @@ class UserWindow(QMainWindow):
         
 
     def logout(self):
-        from main import AuthWindow
         self.auth_window = AuthWindow()
         self.close()
 
+    def open_purchases(self):
+        try:
+            self.purchases_window = PurchasesWindow(self.session)
+        except StorageUnavailable:
+            self.go_offline()
+            if self.labelMessage:
+                self.labelMessage.setText("История покупок недоступна без связи с базой.")
+
     def load_clients(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT users.id, users.username, clients.phone, clients.email, users.password
-            FROM users
-            LEFT JOIN clients ON users.username = clients.name
-            WHERE users.username != 'admin'
-        """)
-        rows = cur.fetchall()
-        conn.close()
-
-        if self.tableClients:
-            self.tableClients.setRowCount(0)
-            self.tableClients.setColumnCount(4)
-            self.tableClients.setHorizontalHeaderLabels(["Логин", "Телефон", "Email", "Пароль"])
-            for i, (uid, username, phone, email, password) in enumerate(rows):
-                self.tableClients.insertRow(i)
-                item0 = QTableWidgetItem(username)
-                item0.setData(Qt.UserRole, uid)
-                self.tableClients.setItem(i, 0, item0)
-                self.tableClients.setItem(i, 1, QTableWidgetItem(phone if phone else ""))
-                self.tableClients.setItem(i, 2, QTableWidgetItem(email if email else ""))
-                self.tableClients.setItem(i, 3, QTableWidgetItem(password if password else ""))
-
-    def get_connection(self):
-        return sqlite3.connect(DB_NAME)
+        if not self.tableClients:
+            return
+        try:
+            rows = get_storage().list_clients()
+        except StorageUnavailable:
+            self.go_offline()
+            return
+
+        self.tableClients.setRowCount(0)
+        self.tableClients.setColumnCount(4)
+        self.tableClients.setHorizontalHeaderLabels(["Логин", "Телефон", "Email", "Пароль"])
+        for i, (uid, client_id, username, phone, email, password) in enumerate(rows):
+            self.tableClients.insertRow(i)
+            item0 = QTableWidgetItem(username)
+            item0.setData(Qt.UserRole, uid)
+            self.tableClients.setItem(i, 0, item0)
+            self.tableClients.setItem(i, 1, QTableWidgetItem(phone if phone else ""))
+            self.tableClients.setItem(i, 2, QTableWidgetItem(email if email else ""))
+            self.tableClients.setItem(i, 3, QTableWidgetItem(password if password else ""))
 
     def init_db(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        # Create products table if not exists, but check for quantity column separately
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                price REAL
-            )
-        """)
-        # Check if quantity column exists, add if missing
-        cur.execute("PRAGMA table_info(products)")
-        columns = [col[1] for col in cur.fetchall()]
-        if "quantity" not in columns:
-            cur.execute("ALTER TABLE products ADD COLUMN quantity INTEGER DEFAULT 0")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS purchases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT,
-                product_id INTEGER,
-                FOREIGN KEY(product_id) REFERENCES products(id)
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER,
-                date TEXT,
-                FOREIGN KEY(client_id) REFERENCES clients(id)
-            )
-        """)
-        conn.commit()
-        conn.close()
+        try:
+            ensure_schema()
+        except StorageUnavailable:
+            self.go_offline()
 
     def refresh_products(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, name, price, quantity FROM products")
-        rows = cur.fetchall()
-        conn.close()
-        if self.tableProducts:
-            self.tableProducts.setRowCount(0)
-            self.tableProducts.setColumnCount(3)
-            self.tableProducts.setHorizontalHeaderLabels(["Название", "Цена", "Кол-во"])
-            for i, (pid, name, price, quantity) in enumerate(rows):
-                self.tableProducts.insertRow(i)
-                item0 = QTableWidgetItem(name)
-                item0.setData(Qt.UserRole, pid)
-                self.tableProducts.setItem(i, 0, item0)
-                self.tableProducts.setItem(i, 1, QTableWidgetItem(f"{price} ₽"))
-                self.tableProducts.setItem(i, 2, QTableWidgetItem(str(quantity)))
+        catalog = get_catalog()
+        try:
+            if catalog.refresh():
+                # Kept locally so a restart during an outage still has a catalog
+                if catalog.last_changed is None:
+                    get_journal().save_catalog(catalog.products())
+                else:
+                    get_journal().update_catalog(catalog.last_changed)
+            if self.offline:
+                self.offline = False
+                self.update_sync_status()
+        except StorageUnavailable:
+            self.go_offline()
+            if not catalog.generation:
+                catalog.load_snapshot(get_journal().load_catalog())
+        # Nothing changed since the last render: keep the table (and selection) as is
+        if not self.tableProducts or catalog.generation == self.rendered_generation:
+            return
+        self.rendered_generation = catalog.generation
+        self.tableProducts.setRowCount(0)
+        self.tableProducts.setColumnCount(3)
+        self.tableProducts.setHorizontalHeaderLabels(["Название", "Цена", "Кол-во"])
+        for i, product in enumerate(catalog.products(in_stock_only=True)):
+            self.tableProducts.insertRow(i)
+            item0 = QTableWidgetItem(product.name)
+            item0.setData(Qt.UserRole, product.id)
+            self.tableProducts.setItem(i, 0, item0)
+            self.tableProducts.setItem(i, 1, QTableWidgetItem(format_price(product.price_kop)))
+            self.tableProducts.setItem(i, 2, QTableWidgetItem(str(product.quantity)))
 
     def buy_product(self):
         if not self.tableProducts:
@@ -302,62 +474,196 @@ class UserWindow(QMainWindow):
             if self.labelMessage:
                 self.labelMessage.setText("Укажите количество больше 0.")
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
-        # Get current quantity
-        cur.execute("SELECT quantity FROM products WHERE id = ?", (pid,))
-        row_prod = cur.fetchone()
-        if not row_prod:
-            conn.close()
+        # Fast rejection from the cached catalog; the storage re-checks atomically
+        catalog = get_catalog()
+        self.refresh_products()
+        if catalog.get(pid) is None:
             if self.labelMessage:
                 self.labelMessage.setText("Товар не найден.")
             return
-        current_quantity = row_prod[0]
-        if quantity_to_buy > current_quantity:
-            conn.close()
+        # Units already sold offline are not in the catalog yet
+        queued = get_journal().pending_quantity(pid) if self.offline else 0
+        if not catalog.has_stock(pid, quantity_to_buy + queued):
             if self.labelMessage:
                 self.labelMessage.setText("Недостаточно товара на складе.")
             return
-        # Insert purchase(s)
-        for _ in range(quantity_to_buy):
-            cur.execute(
-                "INSERT INTO purchases (username, product_id) VALUES (?, ?)",
-                (self.username, pid)
+        # The same id follows the sale into the journal: if the link dropped
+        # after the server committed, the sync will not sell it twice
+        op_id = new_op_id()
+        if not self.offline:
+            try:
+                get_storage().buy_product(self.session, pid, quantity_to_buy, op_id)
+            except PurchaseError as e:
+                if self.labelMessage:
+                    self.labelMessage.setText(str(e))
+                return
+            except StorageBusy:
+                if self.labelMessage:
+                    self.labelMessage.setText(BUSY_MESSAGE)
+                return
+            except StorageUnavailable:
+                self.go_offline()
+        if self.offline:
+            get_journal().queue_purchase(self.session, catalog.get(pid), quantity_to_buy, op_id)
+            self.update_sync_status()
+            if self.labelMessage:
+                self.labelMessage.setText("Нет связи с базой: покупка сохранена и будет проведена позже.")
+            return
+        # Expired orders are purged at startup and by the admin's order list,
+        # not here: a second write per purchase only adds lock contention
+        self.refresh_products()
+        if self.labelMessage:
+            self.labelMessage.setText("Покупка успешно совершена!")
+
+    def go_offline(self):
+        self.offline = True
+        self.update_sync_status()
+
+    def sync_journal(self):
+        """Timer tick: sends queued work once the database answers again."""
+        journal = get_journal()
+        if not self.offline and not journal.pending_count():
+            return
+        try:
+            # Also creates the schema if the terminal started offline
+            run_startup_maintenance()
+            problems = journal.sync(get_storage())
+        except StorageUnavailable:
+            self.go_offline()
+            return
+        except StorageBusy:
+            # The next tick tries again
+            self.update_sync_status()
+            return
+        self.offline = False
+        self.refresh_products()
+        self.update_sync_status()
+        if problems and self.labelMessage:
+            self.labelMessage.setText(
+                f"Синхронизация: {len(problems)} операций проведено не полностью. "
+                f"Последняя: {problems[-1][3]}"
             )
-        # Deduct quantity or delete product if 0 left
-        new_quantity = current_quantity - quantity_to_buy
-        if new_quantity > 0:
-            cur.execute("UPDATE products SET quantity = ? WHERE id = ?", (new_quantity, pid))
+
+    def update_sync_status(self):
+        if not self.labelSync:
+            return
+        journal = get_journal()
+        mode = "нет связи с базой" if self.offline else "онлайн"
+        self.labelSync.setText(
+            f"Режим: {mode} · в очереди: {journal.pending_count()} · "
+            f"отправлено: {journal.synced_total} ({journal.last_rate:.0f} оп/с)"
+        )
+
+
+class PurchasesWindow(QMainWindow):
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        loader = QUiLoader()
+        ui_file = QFile("purchases_page.ui")
+        if not ui_file.open(QFile.ReadOnly):
+            raise RuntimeError("Не удалось открыть purchases_page.ui")
+        loaded = loader.load(ui_file)
+        ui_file.close()
+
+        if loaded is None:
+            raise RuntimeError("Ошибка загрузки UI из purchases_page.ui")
+
+        if isinstance(loaded, QMainWindow):
+            cw = loaded.centralWidget()
+            if cw is None:
+                raise RuntimeError("В purchases_page.ui у QMainWindow отсутствует centralWidget")
+            cw.setParent(self)
+            self.setCentralWidget(cw)
+            try:
+                self.setWindowTitle(loaded.windowTitle())
+            except Exception:
+                pass
+            self.ui_root = cw
+        elif isinstance(loaded, QWidget):
+            self.setCentralWidget(loaded)
+            self.ui_root = loaded
         else:
-            cur.execute("DELETE FROM products WHERE id = ?", (pid,))
-        # Create order for the current user with delivery date = today + 3 days
-        try:
-            cur.execute("SELECT id FROM clients WHERE name = ?", (self.username,))
-            client_row = cur.fetchone()
-            if client_row:
-                client_id = client_row[0]
-                delivery_date = (date.today() + timedelta(days=3)).strftime("%Y-%m-%d")
-                cur.execute("INSERT INTO orders (client_id, date) VALUES (?, ?)", (client_id, delivery_date))
-        except Exception:
-            pass
-        conn.commit()
-        conn.close()
-        # Cleanup expired orders after purchase
+            raise RuntimeError("Неподдерживаемый корневой виджет в purchases_page.ui")
+
+        self.adjustSize()
+
+        self.tableMyPurchases = self.ui_root.findChild(QTableWidget, "tableMyPurchases")
+        self.labelTotals = self.ui_root.findChild(QLabel, "labelTotals")
+        self.labelPage = self.ui_root.findChild(QLabel, "labelPage")
+        self.btnPrevPage = self.ui_root.findChild(QPushButton, "btnPrevPage")
+        self.btnNextPage = self.ui_root.findChild(QPushButton, "btnNextPage")
+        self.btnClosePurchases = self.ui_root.findChild(QPushButton, "btnClosePurchases")
+
+        if self.btnPrevPage:
+            self.btnPrevPage.clicked.connect(self.prev_page)
+        if self.btnNextPage:
+            self.btnNextPage.clicked.connect(self.next_page)
+        if self.btnClosePurchases:
+            self.btnClosePurchases.clicked.connect(self.close)
+
+        # Keyset paging: each page starts below the smallest id of the previous one,
+        # so every page is a short index-only range scan on idx_purchases_user_ledger.
+        self.page_cursors = [None]
+        self.next_cursor = None
+
+        self.apply_theme()
+        self.load_totals()
+        self.load_page()
         try:
-            self.cleanup_expired_orders()
+            self.resize(560, 480)
         except Exception:
             pass
-        self.refresh_products()
-        if self.labelMessage:
-            self.labelMessage.setText("Покупка успешно совершена!")
+        self.show()
 
-    def cleanup_expired_orders(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        today_str = date.today().strftime("%Y-%m-%d")
-        cur.execute("DELETE FROM orders WHERE date <= ?", (today_str,))
-        conn.commit()
-        conn.close()
+    def apply_theme(self):
+        self.setStyleSheet(build_stylesheet_dark())
+        apply_shadows([getattr(self, 'tableMyPurchases', None)])
+
+    def load_totals(self):
+        count, total = get_storage().purchase_totals(self.session.user_id)
+        self.total_count = count
+        if self.labelTotals:
+            self.labelTotals.setText(f"Всего покупок: {count}, на сумму: {format_price(total)}")
+
+    def load_page(self):
+        cursor = self.page_cursors[-1]
+        # One extra row tells whether a next page exists
+        rows = get_storage().purchase_page(self.session.user_id, cursor, PURCHASES_PAGE_SIZE + 1)
+
+        has_next = len(rows) > PURCHASES_PAGE_SIZE
+        rows = rows[:PURCHASES_PAGE_SIZE]
+        self.next_cursor = rows[-1][0] if has_next else None
+
+        if self.tableMyPurchases:
+            self.tableMyPurchases.setRowCount(0)
+            self.tableMyPurchases.setColumnCount(3)
+            self.tableMyPurchases.setHorizontalHeaderLabels(["№", "Товар", "Цена"])
+            for i, (purchase_id, name, price) in enumerate(rows):
+                self.tableMyPurchases.insertRow(i)
+                self.tableMyPurchases.setItem(i, 0, QTableWidgetItem(str(purchase_id)))
+                self.tableMyPurchases.setItem(i, 1, QTableWidgetItem(name if name else "Товар удалён"))
+                self.tableMyPurchases.setItem(i, 2, QTableWidgetItem(format_price(price)))
+
+        pages = max(1, -(-self.total_count // PURCHASES_PAGE_SIZE))
+        if self.labelPage:
+            self.labelPage.setText(f"Страница {len(self.page_cursors)} из {pages}")
+        if self.btnPrevPage:
+            self.btnPrevPage.setEnabled(len(self.page_cursors) > 1)
+        if self.btnNextPage:
+            self.btnNextPage.setEnabled(self.next_cursor is not None)
+
+    def next_page(self):
+        if self.next_cursor is None:
+            return
+        self.page_cursors.append(self.next_cursor)
+        self.load_page()
+
+    def prev_page(self):
+        if len(self.page_cursors) <= 1:
+            return
+        self.page_cursors.pop()
+        self.load_page()
 
 
 class AuthWindow(QMainWindow):
@@ -411,14 +717,32 @@ class AuthWindow(QMainWindow):
         if self.btnRegister:
             self.btnRegister.clicked.connect(self.register)
 
-        self.init_db()
-        try:
-            self.cleanup_expired_orders()
-        except Exception:
-            pass
-        self.ensure_admin()
+        # DB maintenance waits for the first paint of the form, see eventFilter
+        self.ui_root.installEventFilter(self)
         self.show()
 
+    def eventFilter(self, obj, event):
+        if obj is self.ui_root and event.type() == QEvent.Paint:
+            self.ui_root.removeEventFilter(self)
+            # The form is being painted; maintenance may block for a while,
+            # so it starts on the next loop pass, once the frame is on screen
+            QTimer.singleShot(0, self.on_first_show)
+        return super().eventFilter(obj, event)
+
+    def on_first_show(self):
+        startup_profile.mark_login_form()
+        try:
+            run_startup_maintenance()
+        except StorageUnavailable:
+            if self.labelError:
+                self.labelError.setText("Нет связи с базой: работа в автономном режиме")
+        except StorageBusy:
+            # Maintenance is retried on login
+            if self.labelError:
+                self.labelError.setText(BUSY_MESSAGE)
+        startup_profile.report()
+        startup_profile.enabled = False
+
     def apply_theme(self):
         self.setStyleSheet(build_stylesheet_dark())
         apply_shadows([
@@ -426,48 +750,6 @@ class AuthWindow(QMainWindow):
             getattr(self, 'tableClients', None),
         ])
 
-    def get_connection(self):
-        return sqlite3.connect(DB_NAME)
-
-    def init_db(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE,
-                password TEXT,
-                role TEXT
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS clients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                phone TEXT,
-                email TEXT
-            )
-        """)
-        conn.commit()
-        conn.close()
-
-    def cleanup_expired_orders(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        today_str = date.today().strftime("%Y-%m-%d")
-        cur.execute("DELETE FROM orders WHERE date <= ?", (today_str,))
-        conn.commit()
-        conn.close()
-
-    def ensure_admin(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE username = ?", ("admin",))
-        if not cur.fetchone():
-            cur.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ("admin", "admin123", "admin"))
-            conn.commit()
-        conn.close()
-
     def login(self):
         username = self.inputLogin.text() if self.inputLogin else ""
         password = self.inputPassword.text() if self.inputPassword else ""
@@ -475,20 +757,32 @@ class AuthWindow(QMainWindow):
             if self.labelError:
                 self.labelError.setText("Введите логин и пароль")
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT role FROM users WHERE username = ? AND password = ?", (username, password))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            role = row[0]
+        offline = False
+        try:
+            run_startup_maintenance()
+            session = get_storage().authenticate(username, password)
+            if session:
+                get_journal().remember_session(session, password)
+        except StorageUnavailable:
+            # Only users who have logged in on this terminal before
+            offline = True
+            session = get_journal().cached_session(username, password)
+        except StorageBusy:
+            if self.labelError:
+                self.labelError.setText(BUSY_MESSAGE)
+            return
+        if session and offline and session.is_admin:
+            if self.labelError:
+                self.labelError.setText("Нет связи с базой: администрирование недоступно")
+            return
+        if session:
             if self.labelError:
                 self.labelError.setText("")
-            if role == "admin":
-                self.client_app = ClientApp()
+            if session.is_admin:
+                self.client_app = ClientApp(session)
                 self.close()
             else:
-                self.user_app = UserWindow(username)
+                self.user_app = UserWindow(session)
                 self.close()
         else:
             if self.labelError:
@@ -507,25 +801,31 @@ class AuthWindow(QMainWindow):
             if self.labelError:
                 self.labelError.setText("Введите телефон и email")
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-        if cur.fetchone():
+        try:
+            run_startup_maintenance()
+            registered = get_storage().register_user(username, password, phone, email)
+        except StorageUnavailable:
+            get_journal().queue_registration(username, password, phone, email)
+            if self.labelError:
+                self.labelError.setText("Нет связи с базой. Регистрация будет отправлена, "
+                                        "как только связь восстановится.")
+            return
+        except StorageBusy:
+            if self.labelError:
+                self.labelError.setText(BUSY_MESSAGE)
+            return
+        if not registered:
             if self.labelError:
                 self.labelError.setText("Пользователь уже существует")
-            conn.close()
             return
-        cur.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, password, "user"))
-        cur.execute("INSERT INTO clients (name, phone, email) VALUES (?, ?, ?)", (username, phone, email))
-        conn.commit()
-        conn.close()
         if self.labelError:
             self.labelError.setText("Регистрация успешна. Теперь вы можете войти.")
 
 
 class ClientApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, session):
         super().__init__()
+        self.session = session
         loader = QUiLoader()
         ui_file = QFile("main_window.ui")
         if not ui_file.open(QFile.ReadOnly):
@@ -561,6 +861,9 @@ class ClientApp(QMainWindow):
         self.tableClients = self.ui_root.findChild(QTableWidget, "tableClients")
         self.tableProducts = self.ui_root.findChild(QTableWidget, "tableProducts")
         self.tableOrders = self.ui_root.findChild(QTableWidget, "tableOrders")
+        self.tableAudit = self.ui_root.findChild(QTableWidget, "tableAudit")
+        self.tableLowStock = self.ui_root.findChild(QTableWidget, "tableLowStock")
+        self.labelLowStock = self.ui_root.findChild(QLabel, "labelLowStock")
 
         self.comboClient = self.ui_root.findChild(QComboBox, "comboClient")
 
@@ -573,8 +876,8 @@ class ClientApp(QMainWindow):
         self.inputProductName  = self.ui_root.findChild(QLineEdit, "inputProductName")
         self.inputProductPrice = self.ui_root.findChild(QLineEdit, "inputProductPrice")
         # Add reference to inputProductQuantity
-        from PySide6.QtWidgets import QSpinBox
         self.inputProductQuantity = self.ui_root.findChild(QSpinBox, "inputProductQuantity")
+        self.inputProductThreshold = self.ui_root.findChild(QSpinBox, "inputProductThreshold")
 
         self.inputOrderDate    = self.ui_root.findChild(QLineEdit, "inputOrderDate")
 
@@ -582,6 +885,8 @@ class ClientApp(QMainWindow):
         self.btnDeleteClient = self.ui_root.findChild(QPushButton, "btnDeleteClient")
         self.btnAddProduct    = self.ui_root.findChild(QPushButton, "btnAddProduct")
         self.btnDeleteProduct = self.ui_root.findChild(QPushButton, "btnDeleteProduct")
+        self.btnRestockProduct = self.ui_root.findChild(QPushButton, "btnRestockProduct")
+        self.btnSetThreshold  = self.ui_root.findChild(QPushButton, "btnSetThreshold")
         self.btnAddOrder    = self.ui_root.findChild(QPushButton, "btnAddOrder")
         self.btnDeleteOrder = self.ui_root.findChild(QPushButton, "btnDeleteOrder")
         # New button for password change (assume exists in UI)
@@ -589,14 +894,22 @@ class ClientApp(QMainWindow):
         # Button for logout (assume exists in UI)
         self.btnLogout = self.ui_root.findChild(QPushButton, "btnLogout")
 
+        self.inputAuditUser = self.ui_root.findChild(QLineEdit, "inputAuditUser")
+        self.inputAuditFrom = self.ui_root.findChild(QLineEdit, "inputAuditFrom")
+        self.inputAuditTo   = self.ui_root.findChild(QLineEdit, "inputAuditTo")
+        self.btnAuditSearch = self.ui_root.findChild(QPushButton, "btnAuditSearch")
+
         if self.btnAddClient:    self.btnAddClient.clicked.connect(self.add_client)
         if self.btnDeleteClient: self.btnDeleteClient.clicked.connect(self.delete_client)
         if self.btnAddProduct:    self.btnAddProduct.clicked.connect(self.add_product)
         if self.btnDeleteProduct: self.btnDeleteProduct.clicked.connect(self.delete_product)
+        if self.btnRestockProduct: self.btnRestockProduct.clicked.connect(self.restock_product)
+        if self.btnSetThreshold:  self.btnSetThreshold.clicked.connect(self.set_product_threshold)
         if self.btnAddOrder:    self.btnAddOrder.clicked.connect(self.add_order)
         if self.btnDeleteOrder: self.btnDeleteOrder.clicked.connect(self.delete_order)
         if self.btnChangePassword: self.btnChangePassword.clicked.connect(self.change_user_password)
         if self.btnLogout: self.btnLogout.clicked.connect(self.logout)
+        if self.btnAuditSearch: self.btnAuditSearch.clicked.connect(self.load_audit)
 
         self.apply_theme()
         self.init_db()
@@ -604,46 +917,18 @@ class ClientApp(QMainWindow):
             self.cleanup_expired_orders()
         except Exception:
             pass
+        self.low_stock_ids = set()
+        self.rendered_generation = None
         self.refresh_all()
+        self.load_audit()
         self.show()
-
-    def get_connection(self):
-        return sqlite3.connect(DB_NAME)
+        self.check_low_stock()
+        self.lowStockTimer = QTimer(self)
+        self.lowStockTimer.timeout.connect(self.check_low_stock)
+        self.lowStockTimer.start(LOW_STOCK_CHECK_MS)
 
     def init_db(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS clients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                phone TEXT,
-                email TEXT
-            )
-        """)
-        # Create products table if not exists, but check for quantity column separately
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                price REAL
-            )
-        """)
-        # Check if quantity column exists, add if missing
-        cur.execute("PRAGMA table_info(products)")
-        columns = [col[1] for col in cur.fetchall()]
-        if "quantity" not in columns:
-            cur.execute("ALTER TABLE products ADD COLUMN quantity INTEGER DEFAULT 0")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER,
-                date TEXT,
-                FOREIGN KEY(client_id) REFERENCES clients(id)
-            )
-        """)
-        conn.commit()
-        conn.close()
+        ensure_schema()
 
     def apply_theme(self):
         self.setStyleSheet(build_stylesheet_dark())
@@ -651,36 +936,28 @@ class ClientApp(QMainWindow):
             getattr(self, 'tableClients', None),
             getattr(self, 'tableProducts', None),
             getattr(self, 'tableOrders', None),
+            getattr(self, 'tableAudit', None),
         ])
         
 
     def cleanup_expired_orders(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        today_str = date.today().strftime("%Y-%m-%d")
-        cur.execute("DELETE FROM orders WHERE date <= ?", (today_str,))
-        conn.commit()
-        conn.close()
+        get_storage().cleanup_expired_orders()
 
     def refresh_all(self):
         self.load_clients()
         self.load_products()
         self.load_orders()
+        if self.isVisible():
+            self.check_low_stock()
+
+    def closeEvent(self, event):
+        self.lowStockTimer.stop()
+        super().closeEvent(event)
 
 
     def load_clients(self):
         try:
-            conn = self.get_connection()
-            cur = conn.cursor()
-            # LEFT JOIN users and clients, exclude admin, show password
-            cur.execute("""
-                SELECT users.id, users.username, clients.phone, clients.email, users.password
-                FROM users
-                LEFT JOIN clients ON users.username = clients.name
-                WHERE users.username != 'admin'
-            """)
-            rows = cur.fetchall()
-            conn.close()
+            rows = get_storage().list_clients()
         except Exception as e:
             QMessageBox.warning(self, "Ошибка", f"Ошибка загрузки клиентов: {e}")
             return
@@ -689,7 +966,7 @@ class ClientApp(QMainWindow):
         self.tableClients.setColumnCount(4)
         self.tableClients.setHorizontalHeaderLabels(["Логин", "Телефон", "Email", "Пароль"])
         self.comboClient.clear()
-        for i, (uid, username, phone, email, password) in enumerate(rows):
+        for i, (uid, client_id, username, phone, email, password) in enumerate(rows):
             self.tableClients.insertRow(i)
             item0 = QTableWidgetItem(username)
             item0.setData(Qt.UserRole, uid)
@@ -697,7 +974,9 @@ class ClientApp(QMainWindow):
             self.tableClients.setItem(i, 1, QTableWidgetItem(phone if phone else ""))
             self.tableClients.setItem(i, 2, QTableWidgetItem(email if email else ""))
             self.tableClients.setItem(i, 3, QTableWidgetItem(password if password else ""))
-            self.comboClient.addItem(f"{uid}: {username}", uid)
+            # Orders reference clients.id, not the user id
+            if client_id is not None:
+                self.comboClient.addItem(f"{client_id}: {username}", client_id)
 
     def logout(self):
         # Закрыть текущее окно и открыть окно авторизации
@@ -712,13 +991,10 @@ class ClientApp(QMainWindow):
         if not name or not password:
             QMessageBox.warning(self, "Ошибка", "Введите имя и пароль клиента!")
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
         # Добавить в users и clients
-        cur.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (name, password, "user"))
-        cur.execute("INSERT INTO clients(name, phone, email) VALUES (?, ?, ?)", (name, phone, email))
-        conn.commit()
-        conn.close()
+        if not get_storage().register_user(name, password, phone, email, actor=self.session.username):
+            QMessageBox.warning(self, "Ошибка", "Пользователь уже существует!")
+            return
         self.refresh_all()
         if self.inputClientName:
             self.inputClientName.clear()
@@ -738,8 +1014,8 @@ class ClientApp(QMainWindow):
         if not item:
             QMessageBox.warning(self, "Ошибка", "Ошибка выбора пользователя!")
             return
-        cid = item.data(Qt.UserRole)
-        if cid is None:
+        uid = item.data(Qt.UserRole)
+        if uid is None:
             QMessageBox.warning(self, "Ошибка", "Ошибка идентификатора пользователя!")
             return
 
@@ -748,20 +1024,11 @@ class ClientApp(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Введите новый пароль!")
             return
 
-        conn = self.get_connection()
-        cur = conn.cursor()
-        # Найти username по client_id
-        cur.execute("SELECT name FROM clients WHERE id = ?", (cid,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
+        # Таблица хранит users.id, пароль обновляется по нему
+        username = get_storage().change_password(uid, new_pass, self.session.username)
+        if not username:
             QMessageBox.warning(self, "Ошибка", "Пользователь не найден!")
             return
-        username = row[0]
-        # Обновить пароль
-        cur.execute("UPDATE users SET password = ? WHERE username = ?", (new_pass, username))
-        conn.commit()
-        conn.close()
         QMessageBox.information(self, "Успех", f"Пароль для {username} обновлен!")
         if self.inputUserPassword:
             self.inputUserPassword.clear()
@@ -777,44 +1044,92 @@ class ClientApp(QMainWindow):
         if uid is None:
             return
 
-        conn = self.get_connection()
-        cur = conn.cursor()
-        # Get username from users table
-        cur.execute("SELECT username FROM users WHERE id = ?", (uid,))
-        row_user = cur.fetchone()
-        if not row_user:
-            conn.close()
-            return
-        username = row_user[0]
-        if username == "admin":
-            QMessageBox.warning(self, "Ошибка", "Нельзя удалить админа!")
-            conn.close()
-            return
-        # Delete from users and clients
-        cur.execute("DELETE FROM users WHERE id = ?", (uid,))
-        cur.execute("DELETE FROM clients WHERE name = ?", (username,))
-        conn.commit()
-        conn.close()
+        # Client card, orders and purchases are removed by the cascade
+        try:
+            get_storage().delete_user(uid, self.session.username)
+        except StorageError as e:
+            QMessageBox.warning(self, "Ошибка", str(e))
+            return
         self.refresh_all()
 
     def load_products(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, name, price, quantity FROM products")
-        rows = cur.fetchall()
-        conn.close()
+        catalog = get_catalog()
+        catalog.refresh()
+        if catalog.generation == self.rendered_generation:
+            return
+        self.rendered_generation = catalog.generation
 
         self.tableProducts.setRowCount(0)
-        self.tableProducts.setColumnCount(3)
-        self.tableProducts.setHorizontalHeaderLabels(["Название", "Цена", "Кол-во"])
+        self.tableProducts.setColumnCount(4)
+        self.tableProducts.setHorizontalHeaderLabels(["Название", "Цена", "Кол-во", "Порог"])
 
-        for i, (pid, name, price, quantity) in enumerate(rows):
+        for i, product in enumerate(catalog.products()):
             self.tableProducts.insertRow(i)
-            item0 = QTableWidgetItem(name)
-            item0.setData(Qt.UserRole, pid)
+            item0 = QTableWidgetItem(product.name)
+            item0.setData(Qt.UserRole, product.id)
             self.tableProducts.setItem(i, 0, item0)
-            self.tableProducts.setItem(i, 1, QTableWidgetItem(f"{price} ₽"))
-            self.tableProducts.setItem(i, 2, QTableWidgetItem(str(quantity)))
+            self.tableProducts.setItem(i, 1, QTableWidgetItem(format_price(product.price_kop)))
+            self.tableProducts.setItem(i, 2, QTableWidgetItem(str(product.quantity)))
+            self.tableProducts.setItem(i, 3, QTableWidgetItem(str(product.reorder_threshold)))
+
+    def check_low_stock(self):
+        """Refreshes the low-stock panel and notifies about products that
+        have crossed their reorder threshold since the previous check."""
+        try:
+            rows = get_storage().low_stock_products()
+        except Exception:
+            return
+
+        if self.tableLowStock:
+            self.tableLowStock.setRowCount(0)
+            self.tableLowStock.setColumnCount(3)
+            self.tableLowStock.setHorizontalHeaderLabels(["Название", "Кол-во", "Порог"])
+            for i, (pid, name, quantity, threshold) in enumerate(rows):
+                self.tableLowStock.insertRow(i)
+                item0 = QTableWidgetItem(name)
+                item0.setData(Qt.UserRole, pid)
+                self.tableLowStock.setItem(i, 0, item0)
+                self.tableLowStock.setItem(i, 1, QTableWidgetItem(str(quantity)))
+                self.tableLowStock.setItem(i, 2, QTableWidgetItem(str(threshold)))
+        if self.labelLowStock:
+            self.labelLowStock.setText(f"Заканчивается товаров: {len(rows)}")
+
+        current = {pid for pid, _, _, _ in rows}
+        crossed = [r for r in rows if r[0] not in self.low_stock_ids]
+        self.low_stock_ids = current
+        if crossed and self.isVisible():
+            lines = "\n".join(f"• {name}: {quantity} шт. (порог {threshold})" for _, name, quantity, threshold in crossed)
+            QMessageBox.information(self, "Мало товара", f"Пора пополнить запасы:\n{lines}")
+
+    def selected_product_id(self):
+        row = self.tableProducts.currentRow()
+        if row < 0:
+            return None
+        item = self.tableProducts.item(row, 0)
+        if not item:
+            return None
+        return item.data(Qt.UserRole)
+
+    def restock_product(self):
+        pid = self.selected_product_id()
+        if pid is None:
+            QMessageBox.warning(self, "Ошибка", "Выберите товар!")
+            return
+        quantity = self.inputProductQuantity.value() if self.inputProductQuantity else 0
+        if quantity < 1:
+            QMessageBox.warning(self, "Ошибка", "Введите количество больше 0!")
+            return
+        get_storage().restock_product(pid, quantity, self.session.username)
+        self.refresh_all()
+
+    def set_product_threshold(self):
+        pid = self.selected_product_id()
+        if pid is None:
+            QMessageBox.warning(self, "Ошибка", "Выберите товар!")
+            return
+        threshold = self.inputProductThreshold.value() if self.inputProductThreshold else 0
+        get_storage().set_reorder_threshold(pid, threshold, self.session.username)
+        self.refresh_all()
 
     def add_product(self):
         name  = self.inputProductName.text()  if self.inputProductName  else ""
@@ -828,11 +1143,13 @@ class ClientApp(QMainWindow):
         if quantity < 1:
             QMessageBox.warning(self, "Ошибка", "Введите количество больше 0!")
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO products(name, price, quantity) VALUES(?, ?, ?)", (name, price, quantity))
-        conn.commit()
-        conn.close()
+        try:
+            price_kop = parse_price(price)
+        except ValueError as e:
+            QMessageBox.warning(self, "Ошибка", str(e))
+            return
+        threshold = self.inputProductThreshold.value() if self.inputProductThreshold else 0
+        get_storage().add_product(name, price_kop, quantity, self.session.username, threshold)
         self.refresh_all()
 
     def delete_product(self):
@@ -845,11 +1162,7 @@ class ClientApp(QMainWindow):
         pid = item.data(Qt.UserRole)
         if pid is None:
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM products WHERE id = ?", (pid,))
-        conn.commit()
-        conn.close()
+        get_storage().delete_product(pid, self.session.username)
         self.refresh_all()
 
     
@@ -858,15 +1171,7 @@ class ClientApp(QMainWindow):
             self.cleanup_expired_orders()
         except Exception:
             pass
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT orders.id, clients.name, date
-            FROM orders
-            JOIN clients ON clients.id = orders.client_id
-        """)
-        rows = cur.fetchall()
-        conn.close()
+        rows = get_storage().list_orders()
 
         self.tableOrders.setRowCount(0)
         self.tableOrders.setColumnCount(2)
@@ -885,11 +1190,7 @@ class ClientApp(QMainWindow):
         if not cid:
             QMessageBox.warning(self, "Ошибка", "Выберите клиента!")
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO orders(client_id, date) VALUES(?, ?)", (cid, date))
-        conn.commit()
-        conn.close()
+        get_storage().add_order(cid, date, self.session.username)
         self.refresh_all()
 
     def delete_order(self):
@@ -902,15 +1203,40 @@ class ClientApp(QMainWindow):
         oid = item.data(Qt.UserRole)
         if oid is None:
             return
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM orders WHERE id = ?", (oid,))
-        conn.commit()
-        conn.close()
+        get_storage().delete_order(oid, self.session.username)
         self.refresh_all()
 
+    def load_audit(self):
+        actor = self.inputAuditUser.text().strip() if self.inputAuditUser else ""
+        date_from = self.inputAuditFrom.text().strip() if self.inputAuditFrom else ""
+        date_to = self.inputAuditTo.text().strip() if self.inputAuditTo else ""
+        try:
+            rows = get_storage().audit_entries(actor or None, date_from or None, date_to or None)
+        except ValueError:
+            QMessageBox.warning(self, "Ошибка", "Дата должна быть в формате YYYY-MM-DD!")
+            return
+
+        if not self.tableAudit:
+            return
+        self.tableAudit.setRowCount(0)
+        self.tableAudit.setColumnCount(5)
+        self.tableAudit.setHorizontalHeaderLabels(["Время", "Пользователь", "Действие", "Объект", "Детали"])
+        for i, (ts, actor, action, entity, entity_id, details) in enumerate(rows):
+            self.tableAudit.insertRow(i)
+            self.tableAudit.setItem(i, 0, QTableWidgetItem(ts))
+            self.tableAudit.setItem(i, 1, QTableWidgetItem(actor or ""))
+            self.tableAudit.setItem(i, 2, QTableWidgetItem(AUDIT_ACTION_TITLES.get(action, action)))
+            self.tableAudit.setItem(i, 3, QTableWidgetItem(f"{entity} #{entity_id}" if entity_id is not None else (entity or "")))
+            self.tableAudit.setItem(i, 4, QTableWidgetItem(details or ""))
+
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = AuthWindow()
+    argv = list(sys.argv)
+    if "--profile-startup" in argv:
+        argv.remove("--profile-startup")
+        startup_profile.enabled = True
+    with startup_profile.phase("QApplication"):
+        app = QApplication(argv)
+    with startup_profile.phase("окно входа (UI + show)"):
+        window = AuthWindow()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""Money input shared by the windows and the storage migrations. No Qt here:
+storage.py and the tests import it without PySide6.
+
+Prices are kept as integer kopecks; formatting for display stays in main.py,
+where the Qt locale is.
+"""
+from decimal import Decimal, InvalidOperation
+
+
+# Largest price accepted, in rubles: the kopecks still fit a 32-bit INTEGER
+MAX_PRICE_RUB = 10_000_000
+
+
+def parse_price(text):
+    """Parses a price typed in rubles ("1 299,90", "15.5") into kopecks.
+    Raises ValueError for anything that is not a non-negative amount of at
+    most MAX_PRICE_RUB with at most two significant decimals ("10.500" is
+    fine, "10.505" is not)."""
+    cleaned = text.replace("₽", "").replace(" ", "").replace("\u00a0", "").replace(",", ".").strip()
+    try:
+        amount = Decimal(cleaned)
+    except InvalidOperation:
+        raise ValueError(f"Некорректная цена: {text}")
+    if not amount.is_finite() or amount < 0 or amount > MAX_PRICE_RUB:
+        raise ValueError(f"Некорректная цена: {text}")
+    if amount.normalize().as_tuple().exponent < -2:
+        raise ValueError(f"Некорректная цена: {text}")
+    return int(amount * 100)
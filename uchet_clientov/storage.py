@@ -0,0 +1,1329 @@
+"""Storage backends: one repository interface for users, clients, products,
+orders and purchases, with SQLite (default) and PostgreSQL implementations.
+
+The windows in main.py only talk to a Storage object, never to a driver.
+Money is stored as integer kopecks (price_kop columns), so sums are exact
+and done entirely in SQL.
+
+Every mutation also appends a row to the audit log inside the same
+transaction. The log is split into one append-only table per month
+(audit_log_YYYYMM), with an audit_log view over all of them.
+
+CatalogCache keeps the product catalog in memory and re-reads only what
+Storage.data_version() says has changed. Admin catalog edits (new, deleted,
+re-priced products, thresholds) bump a one-row catalog_version counter;
+stock changes only stamp the product row itself (stock_version), so
+purchases never queue up behind a shared row. On PostgreSQL the stamp is
+the writer's txid and the cache re-reads from its last snapshot's xmin,
+so a transaction that commits late is still picked up.
+
+Foreign keys are enforced on every connection. Deleting a user cascades to
+their client card, orders and purchases; deleting a product keeps its
+purchases with product_id set to NULL. check_integrity() finds (and
+optionally repairs) rows written before enforcement that still point
+nowhere.
+
+Driver errors meaning "the database cannot be reached" (a dropped network
+share, a lost PostgreSQL link) are raised as StorageUnavailable, so a
+terminal can switch to its offline journal (journal.py). Queued work comes
+back through apply_offline_batch().
+
+open_storage() picks the backend from a URL:
+
+    kursach.db                      -> SQLiteStorage (file)
+    sqlite:///:memory:              -> SQLiteStorage (in-process, shared cache)
+    postgresql://user@host/dbname   -> PostgresStorage (needs psycopg2)
+
+PostgresStorage needs PostgreSQL 11 or newer. psycopg2 is imported only
+when a PostgreSQL URL is opened, so SQLite terminals never load it. The
+contract tests in tests/ run against a real server when
+UCHET_TEST_PG_DSN is set (see tests/conftest.py).
+"""
+import itertools
+import json
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from money import parse_price
+
+
+DEFAULT_POOL_SIZE = 4
+ORDER_DELIVERY_DAYS = 3
+AUDIT_TABLE_PREFIX = "audit_log_"
+AUDIT_QUERY_LIMIT = 500
+# Orphan checks walk each table in id ranges of this size, one short
+# transaction per range, so a large database is never locked for long.
+INTEGRITY_BATCH_ROWS = 50_000
+
+# (key, description, table, repair, condition, legacy): rows of `table`
+# matching `condition` are orphans; `repair` is "DELETE" or a SET clause.
+# `legacy` is (column, condition) for databases not migrated yet: if
+# `column` is missing, that condition is checked instead.
+ORPHAN_CHECKS = [
+    ("clients_without_user", "Клиенты без учётной записи", "clients", "DELETE",
+     "user_id IS NULL OR NOT EXISTS (SELECT 1 FROM users WHERE users.id = clients.user_id)",
+     ("user_id", "name IS NULL OR NOT EXISTS (SELECT 1 FROM users WHERE users.username = clients.name)")),
+    ("orders_without_client", "Заказы без клиента", "orders", "DELETE",
+     "client_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM clients WHERE clients.id = orders.client_id)",
+     None),
+    ("purchases_without_user", "Покупки без пользователя", "purchases", "DELETE",
+     "user_id IS NULL OR NOT EXISTS (SELECT 1 FROM users WHERE users.id = purchases.user_id)",
+     ("user_id", "username IS NULL OR NOT EXISTS (SELECT 1 FROM users WHERE users.username = purchases.username)")),
+    ("purchases_without_product", "Покупки удалённых товаров", "purchases", "product_id = NULL",
+     "product_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM products WHERE products.id = purchases.product_id)",
+     None),
+]
+
+_audit_table_re = re.compile(rf"^{AUDIT_TABLE_PREFIX}\d{{6}}$")
+
+_memory_db_counter = itertools.count()
+
+
+def _psycopg2():
+    """The PostgreSQL driver, imported on first use."""
+    try:
+        import psycopg2
+        import psycopg2.extensions
+    except ImportError:
+        raise StorageError("Для PostgreSQL нужен пакет psycopg2 (pip install psycopg2-binary)")
+    return psycopg2
+
+
+class StorageError(Exception):
+    pass
+
+
+class PurchaseError(StorageError):
+    """Purchase rejected; the message is shown to the user as is."""
+
+
+class StorageUnavailable(StorageError):
+    """The database cannot be reached right now; worth retrying later."""
+
+
+class StorageBusy(StorageError):
+    """Another writer held a lock too long, or the transaction lost a
+    deadlock or serialization conflict; nothing was written, retry later."""
+
+
+class Product:
+    """One catalog row. Slotted: the cache may hold the whole catalog."""
+
+    __slots__ = ("id", "name", "price_kop", "quantity", "reorder_threshold")
+
+    def __init__(self, id, name, price_kop, quantity, reorder_threshold):
+        self.id = id
+        self.name = name
+        self.price_kop = price_kop
+        self.quantity = quantity
+        self.reorder_threshold = reorder_threshold
+
+
+class Session:
+    """Who is logged in, resolved once by Storage.authenticate(). Windows
+    hold it instead of the bare username; client_id is None for a user
+    without a client card."""
+
+    __slots__ = ("user_id", "client_id", "username", "role")
+
+    def __init__(self, user_id, client_id, username, role):
+        self.user_id = user_id
+        self.client_id = client_id
+        self.username = username
+        self.role = role
+
+    @property
+    def is_admin(self):
+        return self.role == "admin"
+
+
+class ConnectionPool:
+    """Fixed-size pool: idle connections are reused, at most `size` are open."""
+
+    def __init__(self, connect, size=DEFAULT_POOL_SIZE, is_broken=None):
+        self._connect = connect
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        # Tells whether an error left the connection unusable
+        self._is_broken = is_broken or (lambda exc: False)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = self._is_broken(e)
+            raise
+        finally:
+            if broken:
+                self._discard(conn)
+            else:
+                self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self._size:
+                self._opened += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        return self._idle.get()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+class Storage:
+    """Repository interface shared by all backends.
+
+    Queries are written once with "?" placeholders; a backend with another
+    paramstyle sets `placeholder` and they are rewritten in `_sql`. Only the
+    schema DDL and driver setup differ per backend.
+    """
+
+    placeholder = "?"
+    # SQL expression for the next products.stock_version value
+    next_stock_version = None
+    # Suffix for a SELECT that must keep the row from being deleted until commit
+    lock_shared = ""
+
+    def __init__(self, connect, pool_size=DEFAULT_POOL_SIZE):
+        self.pool = ConnectionPool(connect, pool_size, is_broken=self._is_unavailable)
+        self._schema_ready = False
+        # Names of existing monthly audit tables; None = not loaded yet
+        self._audit_tables = None
+
+    def _sql(self, sql):
+        if self.placeholder == "?":
+            return sql
+        return sql.replace("?", self.placeholder)
+
+    def _is_unavailable(self, exc):
+        """True if `exc` means the database cannot be reached (as opposed to
+        a constraint, lock or SQL error). Backends override."""
+        return False
+
+    def _is_busy(self, exc):
+        """True if `exc` is a lock timeout, deadlock or serialization
+        failure: the same statements may well succeed later. Backends override."""
+        return False
+
+    @contextmanager
+    def _reachable(self):
+        try:
+            yield
+        except Exception as e:
+            if self._is_unavailable(e):
+                raise StorageUnavailable(str(e)) from e
+            if self._is_busy(e):
+                raise StorageBusy(str(e)) from e
+            raise
+
+    @contextmanager
+    def transaction(self):
+        with self._reachable(), self.pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # A rolled back transaction may have created an audit table
+                self._audit_tables = None
+                raise
+            finally:
+                cur.close()
+
+    def execute(self, cur, sql, params=()):
+        cur.execute(self._sql(sql), params)
+        return cur
+
+    def executemany(self, cur, sql, seq):
+        cur.executemany(self._sql(sql), seq)
+        return cur
+
+    def insert(self, cur, sql, params=()):
+        """Runs an INSERT and returns the new row id."""
+        self.execute(cur, sql, params)
+        return cur.lastrowid
+
+    def fetchall(self, sql, params=()):
+        with self.transaction() as cur:
+            return self.execute(cur, sql, params).fetchall()
+
+    def fetchone(self, sql, params=()):
+        with self.transaction() as cur:
+            return self.execute(cur, sql, params).fetchone()
+
+    def close(self):
+        self.pool.close_all()
+
+    # --- schema ---
+
+    def ensure_schema(self):
+        """Creates all tables and indexes once per storage object."""
+        if self._schema_ready:
+            return
+        with self.transaction() as cur:
+            self._create_schema(cur)
+        self._schema_ready = True
+
+    def _create_schema(self, cur):
+        raise NotImplementedError
+
+    def data_version(self):
+        """(catalog version, stock marker). The first part moves on admin
+        catalog edits, the second on every stock change; both are compared
+        for equality only, and the marker is handed back to stock_changes()."""
+        with self.transaction() as cur:
+            catalog = self.execute(cur, "SELECT version FROM catalog_version").fetchone()[0]
+            stock = self.execute(cur, "SELECT COALESCE(MAX(stock_version), 0) FROM products").fetchone()[0]
+        return catalog, stock
+
+    def stock_changes(self, since):
+        """(id, quantity, stock_version) of products whose stock may have
+        changed since data_version() returned the stock marker `since`. May
+        include unchanged rows, never misses a changed one."""
+        return self.fetchall(
+            "SELECT id, quantity, stock_version FROM products WHERE stock_version > ?", (since,)
+        )
+
+    def _bump_catalog_version(self, cur):
+        # Admin edits only: purchases must not serialize on this row
+        self.execute(cur, "UPDATE catalog_version SET version = version + 1")
+
+    # --- integrity ---
+
+    def check_integrity(self, repair=False, actor="integrity", batch_rows=INTEGRITY_BATCH_ROWS):
+        """Counts (or with repair=True, fixes) orphaned rows. Returns
+        {check key: rows found}. Each check is one pass over the table in
+        id ranges; the NOT EXISTS probes hit primary keys or unique indexes,
+        so the cost is linear in the table size.
+
+        Counting never writes and works on a database the app has not
+        migrated yet. Repair needs the current schema (ensure_schema())."""
+        found = {}
+        for key, _description, table, fix, condition, legacy in ORPHAN_CHECKS:
+            found[key] = 0
+            with self.transaction() as cur:
+                columns = self._columns(cur, table)
+            if not columns:
+                continue
+            if legacy and legacy[0] not in columns:
+                if repair:
+                    raise StorageError(f"Схема {table} устарела: сначала ensure_schema()")
+                condition = legacy[1]
+            lo, hi = self.fetchone(f"SELECT MIN(id), MAX(id) FROM {table}")
+            count = 0
+            if lo is not None:
+                for start in range(lo, hi + 1, batch_rows):
+                    where = f"id >= ? AND id < ? AND {condition}"
+                    params = (start, start + batch_rows)
+                    with self.transaction() as cur:
+                        if not repair:
+                            count += self.execute(cur, f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+                        elif fix == "DELETE":
+                            count += self.execute(cur, f"DELETE FROM {table} WHERE {where}", params).rowcount
+                        else:
+                            count += self.execute(cur, f"UPDATE {table} SET {fix} WHERE {where}", params).rowcount
+            if repair and count:
+                with self.transaction() as cur:
+                    self._audit(cur, actor, "repair_orphans", table, None, check=key, rows=count)
+            found[key] = count
+        return found
+
+    def _columns(self, cur, table):
+        """Column names of `table`; empty if there is no such table."""
+        raise NotImplementedError
+
+    # --- audit log ---
+
+    def _audit(self, cur, actor, action, entity, entity_id=None, **details):
+        """Appends one audit row using the caller's cursor, so it commits or
+        rolls back together with the change it describes."""
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        table = self._audit_table(cur, ts[:7])
+        self.execute(
+            cur,
+            f"INSERT INTO {table} (ts, actor, action, entity, entity_id, details) VALUES (?, ?, ?, ?, ?, ?)",
+            (ts, actor, action, entity, entity_id,
+             json.dumps(details, ensure_ascii=False) if details else None)
+        )
+
+    def _audit_table(self, cur, month):
+        """Name of the audit table for "YYYY-MM", created on first use."""
+        table = f"{AUDIT_TABLE_PREFIX}{month.replace('-', '')}"
+        if self._audit_tables is None:
+            self._audit_tables = set(self._list_audit_tables(cur))
+        if table not in self._audit_tables:
+            self._create_audit_table(cur, table)
+            # Other processes may have added months this one never saw:
+            # the view is built from the tables that exist now
+            tables = set(self._list_audit_tables(cur))
+            self.execute(cur, "DROP VIEW IF EXISTS audit_log")
+            self.execute(cur, "CREATE VIEW audit_log AS " + " UNION ALL ".join(
+                f"SELECT ts, actor, action, entity, entity_id, details FROM {t}" for t in sorted(tables)
+            ))
+            self._audit_tables = tables
+        return table
+
+    def _list_audit_tables(self, cur):
+        raise NotImplementedError
+
+    def _create_audit_table(self, cur, table):
+        raise NotImplementedError
+
+    def audit_entries(self, actor=None, date_from=None, date_to=None, limit=AUDIT_QUERY_LIMIT):
+        """Newest-first (ts, actor, action, entity, entity_id, details) rows.
+
+        date_from/date_to are inclusive "YYYY-MM-DD" strings; anything else
+        raises ValueError. Only the monthly tables overlapping the range are
+        read, each through its (actor, ts) or (ts) index.
+        """
+        # Both bounds are parsed: timestamps and table names are compared as
+        # strings, so "01.10.2026" would silently pick the wrong months
+        start = datetime.strptime(date_from, "%Y-%m-%d").date() if date_from else None
+        end = datetime.strptime(date_to, "%Y-%m-%d").date() if date_to else None
+        conditions, params = [], []
+        if actor:
+            conditions.append("actor = ?")
+            params.append(actor)
+        if start:
+            conditions.append("ts >= ?")
+            params.append(start.strftime("%Y-%m-%d"))
+        if end:
+            conditions.append("ts < ?")
+            params.append((end + timedelta(days=1)).strftime("%Y-%m-%d"))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self.transaction() as cur:
+            # Listed on every call (a catalog lookup): months created by
+            # other terminals must show up here
+            self._audit_tables = set(self._list_audit_tables(cur))
+            tables = sorted(
+                t for t in self._audit_tables
+                if (not start or t[-6:] >= start.strftime("%Y%m"))
+                and (not end or t[-6:] <= end.strftime("%Y%m"))
+            )
+            if not tables:
+                return []
+            sql = " UNION ALL ".join(
+                f"SELECT ts, actor, action, entity, entity_id, details FROM {t}{where}" for t in tables
+            ) + " ORDER BY ts DESC LIMIT ?"
+            return self.execute(cur, sql, params * len(tables) + [limit]).fetchall()
+
+    # --- users and clients ---
+
+    def authenticate(self, username, password):
+        """Returns a Session, or None for a wrong login/password."""
+        row = self.fetchone("""
+            SELECT users.id, clients.id, users.role
+            FROM users
+            LEFT JOIN clients ON clients.user_id = users.id
+            WHERE users.username = ? AND users.password = ?
+        """, (username, password))
+        if not row:
+            return None
+        user_id, client_id, role = row
+        return Session(user_id, client_id, username, role)
+
+    def user_exists(self, username):
+        return self.fetchone("SELECT 1 FROM users WHERE username = ?", (username,)) is not None
+
+    def ensure_admin(self):
+        with self.transaction() as cur:
+            self.execute(cur, "SELECT 1 FROM users WHERE username = ?", ("admin",))
+            if not cur.fetchone():
+                self.execute(
+                    cur,
+                    "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                    ("admin", "admin123", "admin")
+                )
+
+    def register_user(self, username, password, phone, email, role="user", actor=None):
+        """Creates the login and its client card. Returns False if the
+        username is already taken. `actor` defaults to the new user
+        (self-registration)."""
+        with self.transaction() as cur:
+            return self._register_user(cur, username, password, phone, email, role, actor) is not None
+
+    def _register_user(self, cur, username, password, phone, email, role="user", actor=None, **details):
+        """register_user() on the caller's cursor; returns the new user id,
+        or None if the username is taken."""
+        self.execute(cur, "SELECT 1 FROM users WHERE username = ?", (username,))
+        if cur.fetchone():
+            return None
+        user_id = self.insert(
+            cur,
+            "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+            (username, password, role)
+        )
+        self.execute(
+            cur,
+            "INSERT INTO clients (user_id, name, phone, email) VALUES (?, ?, ?, ?)",
+            (user_id, username, phone, email)
+        )
+        self._audit(cur, actor or username, "add_client", "user", user_id,
+                    username=username, role=role, phone=phone, email=email, **details)
+        return user_id
+
+    def list_clients(self):
+        """(user_id, client_id, username, phone, email, password) for every
+        non-admin user; client_id is None for a user without a client card."""
+        return self.fetchall("""
+            SELECT users.id, clients.id, users.username, clients.phone, clients.email, users.password
+            FROM users
+            LEFT JOIN clients ON clients.user_id = users.id
+            WHERE users.username != 'admin'
+        """)
+
+    def change_password(self, user_id, new_password, actor):
+        """Returns the username, or None if the user does not exist."""
+        with self.transaction() as cur:
+            self.execute(cur, "SELECT username FROM users WHERE id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row:
+                return None
+            self.execute(cur, "UPDATE users SET password = ? WHERE id = ?", (new_password, user_id))
+            # The password itself is never written to the log
+            self._audit(cur, actor, "change_password", "user", user_id, username=row[0])
+        return row[0]
+
+    def delete_user(self, user_id, actor):
+        """Deletes the login and its client card. Returns the username, or
+        None if there was nothing to delete. The admin cannot be deleted."""
+        with self.transaction() as cur:
+            self.execute(cur, "SELECT username FROM users WHERE id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row:
+                return None
+            username = row[0]
+            if username == "admin":
+                raise StorageError("Нельзя удалить админа!")
+            # The client card, orders and purchases go with it (ON DELETE CASCADE)
+            self.execute(cur, "DELETE FROM users WHERE id = ?", (user_id,))
+            self._audit(cur, actor, "delete_client", "user", user_id, username=username)
+        return username
+
+    # --- products ---
+
+    def list_products(self, in_stock_only=False):
+        """(id, name, price_kop, quantity, reorder_threshold) for every
+        product, or only those with stock left."""
+        if in_stock_only:
+            return self.fetchall(
+                "SELECT id, name, price_kop, quantity, reorder_threshold FROM products WHERE quantity > 0 ORDER BY id"
+            )
+        return self.fetchall("SELECT id, name, price_kop, quantity, reorder_threshold FROM products ORDER BY id")
+
+    def low_stock_products(self):
+        """(id, name, quantity, reorder_threshold) of products at or below
+        their reorder threshold. Served by the idx_products_low_stock partial
+        index, which only holds those rows."""
+        return self.fetchall("""
+            SELECT id, name, quantity, reorder_threshold
+            FROM products
+            WHERE quantity <= reorder_threshold
+            ORDER BY id
+        """)
+
+    def add_product(self, name, price_kop, quantity, actor, reorder_threshold=0):
+        with self.transaction() as cur:
+            product_id = self.insert(
+                cur,
+                "INSERT INTO products (name, price_kop, quantity, reorder_threshold) VALUES (?, ?, ?, ?)",
+                (name, price_kop, quantity, reorder_threshold)
+            )
+            self._bump_catalog_version(cur)
+            self._audit(cur, actor, "add_product", "product", product_id,
+                        name=name, price_kop=price_kop, quantity=quantity,
+                        reorder_threshold=reorder_threshold)
+
+    def restock_product(self, product_id, quantity, actor):
+        with self.transaction() as cur:
+            self.execute(
+                cur,
+                f"UPDATE products SET quantity = quantity + ?, stock_version = {self.next_stock_version} WHERE id = ?",
+                (quantity, product_id)
+            )
+            if cur.rowcount:
+                self._audit(cur, actor, "restock", "product", product_id, quantity=quantity)
+
+    def set_reorder_threshold(self, product_id, threshold, actor):
+        with self.transaction() as cur:
+            self.execute(
+                cur,
+                "UPDATE products SET reorder_threshold = ? WHERE id = ?",
+                (threshold, product_id)
+            )
+            if cur.rowcount:
+                self._bump_catalog_version(cur)
+                self._audit(cur, actor, "set_threshold", "product", product_id, reorder_threshold=threshold)
+
+    def delete_product(self, product_id, actor):
+        with self.transaction() as cur:
+            self.execute(cur, "DELETE FROM products WHERE id = ?", (product_id,))
+            if cur.rowcount:
+                self._bump_catalog_version(cur)
+                self._audit(cur, actor, "delete_product", "product", product_id)
+
+    def buy_product(self, session, product_id, quantity, op_id=None):
+        """Records `quantity` purchases for the logged-in `session` and
+        creates a delivery order.
+
+        Stock is taken with a single conditional UPDATE, so concurrent buyers
+        can never drive the quantity below zero. Raises PurchaseError, also
+        when an admin has deleted the user since this session logged in.
+
+        `op_id` is stored with the purchase as applied, like an offline
+        entry: if the connection drops during COMMIT, the terminal can queue
+        the sale under the same id and apply_offline_batch() will not apply
+        it a second time.
+        """
+        with self.transaction() as cur:
+            if not self._buyer_exists(cur, session.user_id):
+                raise PurchaseError("Покупатель удалён.")
+            self.execute(
+                cur,
+                f"UPDATE products SET quantity = quantity - ?, stock_version = {self.next_stock_version} "
+                "WHERE id = ? AND quantity >= ?",
+                (quantity, product_id, quantity)
+            )
+            if cur.rowcount != 1:
+                self.execute(cur, "SELECT 1 FROM products WHERE id = ?", (product_id,))
+                if not cur.fetchone():
+                    raise PurchaseError("Товар не найден.")
+                raise PurchaseError("Недостаточно товара на складе.")
+            self.execute(cur, "SELECT price_kop FROM products WHERE id = ?", (product_id,))
+            price_kop = cur.fetchone()[0]
+            self._record_purchase(cur, session.user_id, self._live_client(cur, session.client_id),
+                                  session.username, product_id, quantity, price_kop)
+            if op_id is not None:
+                self._remember_applied(cur, op_id, "done", None)
+
+    def _buyer_exists(self, cur, user_id):
+        """True if the user is still there; it then cannot be deleted until commit."""
+        self.execute(cur, f"SELECT 1 FROM users WHERE id = ?{self.lock_shared}", (user_id,))
+        return cur.fetchone() is not None
+
+    def _live_client(self, cur, client_id):
+        """`client_id`, or None if that client card is gone (no order then)."""
+        if client_id is None:
+            return None
+        self.execute(cur, f"SELECT 1 FROM clients WHERE id = ?{self.lock_shared}", (client_id,))
+        return client_id if cur.fetchone() else None
+
+    def _record_purchase(self, cur, user_id, client_id, actor, product_id, quantity, price_kop, **details):
+        """Ledger rows, delivery order and audit entry for stock already taken."""
+        self.executemany(
+            cur,
+            "INSERT INTO purchases (user_id, product_id, price_kop) VALUES (?, ?, ?)",
+            [(user_id, product_id, price_kop)] * quantity
+        )
+        # Create order for the buyer with delivery date = today + 3 days
+        if client_id is not None:
+            delivery_date = (date.today() + timedelta(days=ORDER_DELIVERY_DAYS)).strftime("%Y-%m-%d")
+            self.execute(
+                cur,
+                "INSERT INTO orders (client_id, date) VALUES (?, ?)",
+                (client_id, delivery_date)
+            )
+        self._audit(cur, actor, "buy_product", "product", product_id,
+                    quantity=quantity, price_kop=price_kop, **details)
+
+    # --- offline terminals ---
+
+    def apply_offline_batch(self, entries):
+        """Replays work queued by offline terminals in one transaction.
+
+        `entries` are (op_id, kind, payload) with kind "purchase" or
+        "register". Returns one (status, message) per entry: "done",
+        "partial" or "rejected". An op_id already applied returns its stored
+        result, so a batch re-sent after a lost reply is never applied twice.
+
+        Stock conflicts: a purchase takes what is left, up to the quantity
+        asked for, at the price the terminal showed. Nothing left, a deleted
+        product or a deleted buyer rejects it.
+        """
+        results = []
+        with self.transaction() as cur:
+            for op_id, kind, payload in entries:
+                self.execute(cur, "SELECT status, message FROM offline_applied WHERE op_id = ?", (op_id,))
+                row = cur.fetchone()
+                if row:
+                    results.append(tuple(row))
+                    continue
+                if kind == "purchase":
+                    status, message = self._replay_purchase(cur, payload)
+                elif kind == "register":
+                    status, message = self._replay_registration(cur, payload)
+                else:
+                    status, message = "rejected", f"Неизвестная операция: {kind}"
+                self._remember_applied(cur, op_id, status, message)
+                results.append((status, message))
+        return results
+
+    def _remember_applied(self, cur, op_id, status, message):
+        self.execute(
+            cur,
+            "INSERT INTO offline_applied (op_id, status, message, applied_at) VALUES (?, ?, ?, ?)",
+            (op_id, status, message, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+
+    def _replay_purchase(self, cur, payload):
+        product_id, wanted = payload["product_id"], payload["quantity"]
+        if not self._buyer_exists(cur, payload["user_id"]):
+            return "rejected", "Покупатель удалён."
+        while True:
+            self.execute(cur, "SELECT quantity FROM products WHERE id = ?", (product_id,))
+            row = cur.fetchone()
+            if not row:
+                return "rejected", "Товар удалён."
+            taken = min(wanted, row[0])
+            if taken <= 0:
+                return "rejected", "Товар закончился."
+            # Same guard as buy_product; retry if another terminal got there first
+            self.execute(
+                cur,
+                f"UPDATE products SET quantity = quantity - ?, stock_version = {self.next_stock_version} "
+                "WHERE id = ? AND quantity >= ?",
+                (taken, product_id, taken)
+            )
+            if cur.rowcount == 1:
+                break
+        client_id = self._live_client(cur, payload.get("client_id"))
+        self._record_purchase(cur, payload["user_id"], client_id, payload["username"],
+                              product_id, taken, payload["price_kop"],
+                              offline=True, requested=wanted, queued_at=payload["queued_at"])
+        if taken < wanted:
+            return "partial", f"Продано {taken} из {wanted}."
+        return "done", None
+
+    def _replay_registration(self, cur, payload):
+        user_id = self._register_user(cur, payload["username"], payload["password"],
+                                      payload["phone"], payload["email"],
+                                      offline=True, queued_at=payload["queued_at"])
+        if user_id is None:
+            return "rejected", "Пользователь уже существует."
+        return "done", None
+
+    # --- orders ---
+
+    def list_orders(self):
+        """(order_id, client_name, date) for every order."""
+        return self.fetchall("""
+            SELECT orders.id, clients.name, orders.date
+            FROM orders
+            JOIN clients ON clients.id = orders.client_id
+        """)
+
+    def add_order(self, client_id, order_date, actor):
+        with self.transaction() as cur:
+            order_id = self.insert(
+                cur,
+                "INSERT INTO orders (client_id, date) VALUES (?, ?)",
+                (client_id, order_date)
+            )
+            self._audit(cur, actor, "add_order", "order", order_id, client_id=client_id, date=order_date)
+
+    def delete_order(self, order_id, actor):
+        with self.transaction() as cur:
+            self.execute(cur, "DELETE FROM orders WHERE id = ?", (order_id,))
+            if cur.rowcount:
+                self._audit(cur, actor, "delete_order", "order", order_id)
+
+    def cleanup_expired_orders(self):
+        today_str = date.today().strftime("%Y-%m-%d")
+        with self.transaction() as cur:
+            self.execute(cur, "DELETE FROM orders WHERE date <= ?", (today_str,))
+
+    # --- purchases ledger ---
+
+    def purchase_totals(self, user_id):
+        """(count, total in kopecks) of the user's purchases."""
+        return self.fetchone("""
+            SELECT COUNT(*), COALESCE(SUM(price_kop), 0)
+            FROM purchases
+            WHERE user_id = ?
+        """, (user_id,))
+
+    def purchase_page(self, user_id, before_id, limit):
+        """Up to `limit` purchases (id, product name, price_kop), newest first,
+        with id < before_id (None = from the newest)."""
+        if before_id is None:
+            return self.fetchall("""
+                SELECT purchases.id, products.name, purchases.price_kop
+                FROM purchases
+                LEFT JOIN products ON products.id = purchases.product_id
+                WHERE purchases.user_id = ?
+                ORDER BY purchases.id DESC
+                LIMIT ?
+            """, (user_id, limit))
+        return self.fetchall("""
+            SELECT purchases.id, products.name, purchases.price_kop
+            FROM purchases
+            LEFT JOIN products ON products.id = purchases.product_id
+            WHERE purchases.user_id = ? AND purchases.id < ?
+            ORDER BY purchases.id DESC
+            LIMIT ?
+        """, (user_id, before_id, limit))
+
+
+# Tables with foreign keys, as templates: an old table is rebuilt from the
+# same DDL when its constraints differ from _SQLITE_FOREIGN_KEYS.
+_SQLITE_TABLES = {
+    "clients": """
+        CREATE TABLE {if_not_exists}{name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT,
+            phone TEXT,
+            email TEXT
+        )
+    """,
+    "purchases": """
+        CREATE TABLE {if_not_exists}{name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
+            price_kop INTEGER
+        )
+    """,
+    "orders": """
+        CREATE TABLE {if_not_exists}{name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER REFERENCES clients(id) ON DELETE CASCADE,
+            date TEXT
+        )
+    """,
+}
+
+# (column, parent table, ON DELETE action) per child table
+_SQLITE_FOREIGN_KEYS = {
+    "clients": {("user_id", "users", "CASCADE")},
+    "purchases": {("user_id", "users", "CASCADE"), ("product_id", "products", "SET NULL")},
+    "orders": {("client_id", "clients", "CASCADE")},
+}
+
+
+class SQLiteStorage(Storage):
+    # Writers are serialized by the database lock, so this never repeats
+    next_stock_version = "(SELECT COALESCE(MAX(stock_version), 0) + 1 FROM products)"
+
+    def __init__(self, path, pool_size=DEFAULT_POOL_SIZE, timeout=5.0):
+        if path == ":memory:":
+            # A private shared-cache database, so every pooled connection
+            # sees the same data; it lives as long as the pool does.
+            path = f"file:uchet_mem_{next(_memory_db_counter)}?mode=memory&cache=shared"
+            # Shared-cache connections lock whole tables and fail at once
+            # instead of honouring the busy timeout: keep to one connection
+            pool_size = 1
+        self.path = path
+        uri = path.startswith("file:")
+
+        def connect():
+            conn = sqlite3.connect(path, timeout=timeout, uri=uri, check_same_thread=False)
+            conn.execute("PRAGMA foreign_keys = ON")
+            return conn
+
+        super().__init__(connect, pool_size)
+
+    def _is_unavailable(self, exc):
+        # Lock timeouts are OperationalError too, but the file is still there.
+        # A share that drops mid-session shows up as I/O or read-only errors.
+        if not isinstance(exc, sqlite3.OperationalError):
+            return False
+        message = str(exc).lower()
+        return any(m in message for m in ("unable to open", "disk i/o error", "readonly database"))
+
+    def _is_busy(self, exc):
+        if not isinstance(exc, sqlite3.OperationalError):
+            return False
+        message = str(exc).lower()
+        return "locked" in message or "busy" in message
+
+    def _columns(self, cur, table):
+        cur.execute(f"PRAGMA table_info({table})")
+        return [col[1] for col in cur.fetchall()]
+
+    def _list_audit_tables(self, cur):
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'audit_log_%'")
+        return [name for (name,) in cur.fetchall() if _audit_table_re.match(name)]
+
+    def _create_audit_table(self, cur, table):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts TEXT NOT NULL,
+                actor TEXT,
+                action TEXT NOT NULL,
+                entity TEXT,
+                entity_id INTEGER,
+                details TEXT
+            )
+        """)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_actor_ts ON {table}(actor, ts)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table}(ts)")
+        for op in ("UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_no_{op.lower()}
+                BEFORE {op} ON {table}
+                BEGIN
+                    SELECT RAISE(ABORT, 'audit log is append-only');
+                END
+            """)
+
+    def _create_table(self, cur, table):
+        cur.execute(_SQLITE_TABLES[table].format(if_not_exists="IF NOT EXISTS ", name=table))
+
+    def _create_schema(self, cur):
+        # sqlite3 runs DDL outside transactions: without this, an ALTER would
+        # commit on its own and a failed upgrade would keep the new column
+        # but lose its backfill. The foreign-key rebuild commits this first.
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                password TEXT,
+                role TEXT
+            )
+        """)
+        self._create_table(cur, "clients")
+        # Clients and purchases point at users by id; older files linked them
+        # by name. The foreign key itself is added by the rebuild below.
+        if "user_id" not in self._columns(cur, "clients"):
+            cur.execute("ALTER TABLE clients ADD COLUMN user_id INTEGER")
+        cur.execute("""
+            UPDATE clients SET user_id = (SELECT id FROM users WHERE users.username = clients.name)
+            WHERE user_id IS NULL AND name IN (SELECT username FROM users)
+        """)
+        # Create products table if not exists, but check for quantity column separately
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                price_kop INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = self._columns(cur, "products")
+        # Check if quantity column exists, add if missing
+        if "quantity" not in columns:
+            cur.execute("ALTER TABLE products ADD COLUMN quantity INTEGER DEFAULT 0")
+        # Older databases kept prices in a REAL "price" column (rubles)
+        if "price_kop" not in columns:
+            cur.execute("ALTER TABLE products ADD COLUMN price_kop INTEGER NOT NULL DEFAULT 0")
+            self._convert_legacy_prices(cur, "products", "product")
+        if "reorder_threshold" not in columns:
+            cur.execute("ALTER TABLE products ADD COLUMN reorder_threshold INTEGER NOT NULL DEFAULT 0")
+        if "stock_version" not in columns:
+            cur.execute("ALTER TABLE products ADD COLUMN stock_version INTEGER NOT NULL DEFAULT 0")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_stock_version ON products(stock_version)")
+        cur.execute("CREATE TABLE IF NOT EXISTS catalog_version (version INTEGER NOT NULL)")
+        cur.execute("INSERT INTO catalog_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM catalog_version)")
+        self._create_table(cur, "purchases")
+        # Purchase price is stored per row so the ledger survives product changes
+        columns = self._columns(cur, "purchases")
+        if "price_kop" not in columns:
+            cur.execute("ALTER TABLE purchases ADD COLUMN price_kop INTEGER")
+            if "price" in columns:
+                self._convert_legacy_prices(cur, "purchases", "purchase")
+            cur.execute("""
+                UPDATE purchases
+                SET price_kop = (SELECT price_kop FROM products WHERE products.id = purchases.product_id)
+                WHERE price_kop IS NULL
+            """)
+        if "user_id" not in columns:
+            cur.execute("ALTER TABLE purchases ADD COLUMN user_id INTEGER")
+        if "username" in columns:
+            cur.execute("""
+                UPDATE purchases SET user_id = (SELECT id FROM users WHERE users.username = purchases.username)
+                WHERE user_id IS NULL AND username IN (SELECT username FROM users)
+            """)
+        self._create_table(cur, "orders")
+        self._migrate_foreign_keys(cur)
+
+        # Indexes come last: rebuilding a table drops its indexes
+        # Only low-stock rows are in this index, so the stock monitor never scans the catalog
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_low_stock
+            ON products(id) WHERE quantity <= reorder_threshold
+        """)
+        # Per-user ledger index: paging and totals in "Мои покупки" read only this
+        # user's range, and price/product are in the index so neither touches the table
+        cur.execute("DROP INDEX IF EXISTS idx_purchases_username_id")
+        cur.execute("DROP INDEX IF EXISTS idx_purchases_user_id")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_purchases_user_ledger
+            ON purchases(user_id, id, price_kop, product_id)
+        """)
+        # Child-side indexes for the foreign keys: cascades and orphan checks
+        # look rows up by these columns
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_product_id ON purchases(product_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_client_id ON orders(client_id)")
+        cur.execute("DROP INDEX IF EXISTS idx_clients_name")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_user_id ON clients(user_id)")
+        # Offline journal entries already replayed and online purchases that
+        # may come back from a journal, keyed by the terminal's op id
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS offline_applied (
+                op_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                message TEXT,
+                applied_at TEXT NOT NULL
+            )
+        """)
+
+    def _convert_legacy_prices(self, cur, table, entity):
+        """Rubles in the old REAL "price" column -> price_kop. The old app
+        stored whatever was typed, so text is parsed with the price field's
+        own rules; a value that cannot be parsed leaves price_kop as it is
+        and goes to the audit log as "price_unparsed"."""
+        cur.execute(f"""
+            UPDATE {table} SET price_kop = CAST(ROUND(price * 100) AS INTEGER)
+            WHERE typeof(price) IN ('real', 'integer')
+        """)
+        rows = cur.execute(f"SELECT id, price FROM {table} WHERE typeof(price) = 'text'").fetchall()
+        for row_id, text in rows:
+            try:
+                cur.execute(f"UPDATE {table} SET price_kop = ? WHERE id = ?", (parse_price(text), row_id))
+            except ValueError:
+                self._audit(cur, "migration", "price_unparsed", entity, row_id, price=text)
+
+    def _foreign_keys(self, cur, table):
+        cur.execute(f"PRAGMA foreign_key_list({table})")
+        return {(row[3], row[2], row[6]) for row in cur.fetchall()}
+
+    def _migrate_foreign_keys(self, cur):
+        """Rebuilds tables created before foreign keys were enforced. Runs
+        once per old database and only copies rows: orphans they may hold
+        are left for check_integrity(), which reports them and repairs them
+        in bounded batches."""
+        stale = [t for t, expected in _SQLITE_FOREIGN_KEYS.items() if self._foreign_keys(cur, t) != expected]
+        if not stale:
+            return
+        conn = cur.connection
+        conn.commit()
+        # Constraints must be off while tables are dropped and renamed
+        cur.execute("PRAGMA foreign_keys = OFF")
+        try:
+            cur.execute("BEGIN")
+            for table in stale:
+                self._rebuild_table(cur, table)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("PRAGMA foreign_keys = ON")
+
+    def _rebuild_table(self, cur, table):
+        """SQLite cannot add constraints to a table: copy it into one created
+        from the current DDL, keeping any extra legacy columns."""
+        old_columns = {row[1]: row[2] for row in cur.execute(f"PRAGMA table_info({table})").fetchall()}
+        new_table = f"{table}_rebuild"
+        cur.execute(f"DROP TABLE IF EXISTS {new_table}")
+        cur.execute(_SQLITE_TABLES[table].format(if_not_exists="", name=new_table))
+        new_columns = self._columns(cur, new_table)
+        for column, column_type in old_columns.items():
+            if column not in new_columns:
+                cur.execute(f"ALTER TABLE {new_table} ADD COLUMN {column} {column_type}")
+        column_list = ", ".join(old_columns)
+        cur.execute(f"INSERT INTO {new_table} ({column_list}) SELECT {column_list} FROM {table}")
+        seq = cur.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        cur.execute(f"DROP TABLE {table}")
+        cur.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+        # Keep AUTOINCREMENT from handing out ids of deleted rows again
+        if seq:
+            cur.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq[0]))
+
+
+class PostgresStorage(Storage):
+    placeholder = "%s"
+    # The writer's txid. Txids do not commit in order (9 may commit after
+    # 10), so MAX(stock_version) cannot say what a reader has seen: the
+    # stock marker is a snapshot instead, see data_version()
+    next_stock_version = "txid_current()"
+    lock_shared = " FOR KEY SHARE"
+
+    def __init__(self, dsn, pool_size=DEFAULT_POOL_SIZE):
+        psycopg2 = _psycopg2()
+        self.dsn = dsn
+        super().__init__(lambda: psycopg2.connect(dsn), pool_size)
+
+    def insert(self, cur, sql, params=()):
+        self.execute(cur, sql + " RETURNING id", params)
+        return cur.fetchone()[0]
+
+    def data_version(self):
+        # Any commit since changes the snapshot. A transaction not yet
+        # committed in it has a txid at or above its xmin, which is what
+        # stock_changes() re-reads from
+        with self.transaction() as cur:
+            catalog = self.execute(cur, "SELECT version FROM catalog_version").fetchone()[0]
+            snapshot = self.execute(cur, "SELECT txid_current_snapshot()::text").fetchone()[0]
+        return catalog, snapshot
+
+    def stock_changes(self, since):
+        return self.fetchall(
+            "SELECT id, quantity, stock_version FROM products "
+            "WHERE stock_version >= txid_snapshot_xmin(?::txid_snapshot)", (since,)
+        )
+
+    def _is_unavailable(self, exc):
+        # Serialization failures, deadlocks and lock timeouts are
+        # OperationalError subclasses but the server is fine; only
+        # connection-level failures count
+        if self._is_busy(exc):
+            return False
+        psycopg2 = _psycopg2()
+        return isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+    def _is_busy(self, exc):
+        # 55P03 lock_not_available, 57014 query_canceled (statement/lock timeout)
+        if isinstance(exc, _psycopg2().extensions.TransactionRollbackError):
+            return True
+        return getattr(exc, "pgcode", None) in ("55P03", "57014")
+
+    def _columns(self, cur, table):
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+        """, (table,))
+        return [name for (name,) in cur.fetchall()]
+
+    def _list_audit_tables(self, cur):
+        cur.execute("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_schema = current_schema() AND table_name LIKE 'audit_log_%'
+        """)
+        return [name for (name,) in cur.fetchall() if _audit_table_re.match(name)]
+
+    def _create_audit_table(self, cur, table):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id BIGSERIAL PRIMARY KEY,
+                ts TEXT NOT NULL,
+                actor TEXT,
+                action TEXT NOT NULL,
+                entity TEXT,
+                entity_id INTEGER,
+                details TEXT
+            )
+        """)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_actor_ts ON {table}(actor, ts)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table}(ts)")
+        # CREATE OR REPLACE TRIGGER would need PostgreSQL 14
+        cur.execute(f"DROP TRIGGER IF EXISTS {table}_append_only ON {table}")
+        cur.execute(f"""
+            CREATE TRIGGER {table}_append_only
+            BEFORE UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION audit_log_append_only()
+        """)
+
+    def _create_schema(self, cur):
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username TEXT UNIQUE,
+                password TEXT,
+                role TEXT
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS clients (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                name TEXT,
+                phone TEXT,
+                email TEXT
+            )
+        """)
+        # Older databases linked clients and purchases to users by name
+        cur.execute("ALTER TABLE clients ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id) ON DELETE CASCADE")
+        cur.execute("""
+            UPDATE clients SET user_id = users.id
+            FROM users WHERE clients.user_id IS NULL AND users.username = clients.name
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                id SERIAL PRIMARY KEY,
+                name TEXT,
+                price_kop INTEGER NOT NULL DEFAULT 0,
+                quantity INTEGER DEFAULT 0,
+                reorder_threshold INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS reorder_threshold INTEGER NOT NULL DEFAULT 0")
+        cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS stock_version BIGINT NOT NULL DEFAULT 0")
+        # Earlier versions numbered stock changes from a sequence; those
+        # numbers are not txids, so start over
+        cur.execute("SELECT to_regclass('products_stock_version_seq')")
+        if cur.fetchone()[0]:
+            cur.execute("UPDATE products SET stock_version = 0")
+            cur.execute("DROP SEQUENCE products_stock_version_seq")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_stock_version ON products(stock_version)")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_low_stock
+            ON products(id) WHERE quantity <= reorder_threshold
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS purchases (
+                id BIGSERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
+                price_kop INTEGER
+            )
+        """)
+        cur.execute("ALTER TABLE purchases ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id) ON DELETE CASCADE")
+        if "username" in self._columns(cur, "purchases"):
+            cur.execute("""
+                UPDATE purchases SET user_id = users.id
+                FROM users WHERE purchases.user_id IS NULL AND users.username = purchases.username
+            """)
+        cur.execute("DROP INDEX IF EXISTS idx_purchases_username_id")
+        cur.execute("DROP INDEX IF EXISTS idx_purchases_user_id")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_purchases_user_ledger
+            ON purchases(user_id, id, price_kop, product_id)
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                id SERIAL PRIMARY KEY,
+                client_id INTEGER REFERENCES clients(id) ON DELETE CASCADE,
+                date TEXT
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_product_id ON purchases(product_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_client_id ON orders(client_id)")
+        cur.execute("DROP INDEX IF EXISTS idx_clients_name")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_user_id ON clients(user_id)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS offline_applied (
+                op_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                message TEXT,
+                applied_at TEXT NOT NULL
+            )
+        """)
+        cur.execute("CREATE TABLE IF NOT EXISTS catalog_version (version BIGINT NOT NULL)")
+        cur.execute("INSERT INTO catalog_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM catalog_version)")
+        # Earlier versions bumped catalog_version from a trigger on every
+        # products statement, purchases included
+        cur.execute("DROP TRIGGER IF EXISTS products_catalog_version ON products")
+        cur.execute("DROP FUNCTION IF EXISTS catalog_version_bump()")
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION audit_log_append_only() RETURNS trigger AS $$
+            BEGIN
+                RAISE EXCEPTION 'audit log is append-only';
+            END
+            $$ LANGUAGE plpgsql
+        """)
+
+
+class CatalogCache:
+    """Process-wide product catalog keyed by id.
+
+    refresh() asks the storage for its data version. An admin catalog edit
+    reloads everything; a stock change re-reads only the rows whose stock
+    moved; otherwise lookups, stock checks and rendering use the records
+    already in memory. `generation` increases on every change, so a view
+    can skip re-rendering data it has already shown. `last_changed` lists
+    the records replaced by the last refresh, or is None after a full load.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._by_id = {}
+        self._data_version = None
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.last_changed = None
+
+    def refresh(self):
+        """Returns True if anything was re-read."""
+        with self._lock:
+            version = self.storage.data_version()
+            if self.generation and version == self._data_version:
+                return False
+            if self.generation and self._data_version and version[0] == self._data_version[0]:
+                changed = []
+                for product_id, quantity, _ in self.storage.stock_changes(self._data_version[1]):
+                    old = self._by_id.get(product_id)
+                    # The delta may repeat rows already seen
+                    if old is not None and old.quantity != quantity:
+                        # Replaced, not mutated: readers may hold the old record
+                        product = Product(product_id, old.name, old.price_kop, quantity, old.reorder_threshold)
+                        self._by_id[product_id] = product
+                        changed.append(product)
+                if not changed:
+                    self._data_version = version
+                    return False
+                self.last_changed = changed
+            else:
+                self._by_id = {row[0]: Product(*row) for row in self.storage.list_products()}
+                self.last_changed = None
+            self._data_version = version
+            self.generation += 1
+            return True
+
+    def load_snapshot(self, rows):
+        """Fills the cache from saved (id, name, price_kop, quantity,
+        reorder_threshold) rows while the database is unreachable. The next
+        successful refresh() re-reads the real catalog."""
+        with self._lock:
+            self._by_id = {row[0]: Product(*row) for row in rows}
+            self._data_version = None
+            self.last_changed = None
+            self.generation += 1
+
+    def products(self, in_stock_only=False):
+        if in_stock_only:
+            return [p for p in self._by_id.values() if p.quantity > 0]
+        return list(self._by_id.values())
+
+    def get(self, product_id):
+        return self._by_id.get(product_id)
+
+    def has_stock(self, product_id, quantity):
+        product = self._by_id.get(product_id)
+        return product is not None and product.quantity >= quantity
+
+
+def open_storage(url, pool_size=DEFAULT_POOL_SIZE):
+    """Creates the backend for `url` (see module docstring)."""
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresStorage(url, pool_size)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteStorage(url, pool_size)
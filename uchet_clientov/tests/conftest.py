@@ -0,0 +1,67 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# The app modules import each other as top-level modules (from storage import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import open_storage  # noqa: E402
+
+# PostgreSQL runs only when a DSN is given (server 11 or newer, psycopg2
+# installed, a role allowed to CREATE SCHEMA in that database), e.g.
+#   UCHET_TEST_PG_DSN=postgresql://postgres@localhost/uchet_test pytest
+# Without it every "postgres" case is skipped: there is no in-process
+# stand-in, so check the skip count before trusting a green run.
+PG_DSN = os.environ.get("UCHET_TEST_PG_DSN")
+
+
+@pytest.fixture(params=["sqlite-memory", "sqlite-file", "postgres"])
+def database_url(request, tmp_path):
+    """URL of an empty database for one test."""
+    if request.param == "sqlite-memory":
+        yield "sqlite:///:memory:"
+    elif request.param == "sqlite-file":
+        yield str(tmp_path / "kursach.db")
+    else:
+        if not PG_DSN:
+            pytest.skip("UCHET_TEST_PG_DSN is not set")
+        psycopg2 = pytest.importorskip("psycopg2")
+        # Each test gets its own schema, dropped afterwards
+        schema = f"uchet_test_{uuid.uuid4().hex[:12]}"
+        admin = psycopg2.connect(PG_DSN)
+        admin.autocommit = True
+        admin.cursor().execute(f"CREATE SCHEMA {schema}")
+        separator = "&" if "?" in PG_DSN else "?"
+        yield f"{PG_DSN}{separator}options=-csearch_path%3D{schema}"
+        admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+@pytest.fixture
+def open_terminal(database_url):
+    """Opens another Storage on the same database, like a second terminal.
+    Not possible for :memory:, which is private to one Storage."""
+    opened = []
+
+    def open_():
+        if database_url == "sqlite:///:memory:":
+            pytest.skip("an in-memory database cannot be shared between Storage objects")
+        storage = open_storage(database_url)
+        storage.ensure_schema()
+        opened.append(storage)
+        return storage
+
+    yield open_
+    for storage in opened:
+        storage.close()
+
+
+@pytest.fixture
+def storage(database_url):
+    storage = open_storage(database_url)
+    storage.ensure_schema()
+    storage.ensure_admin()
+    yield storage
+    storage.close()
@@ -0,0 +1,102 @@
+"""Upgrade and integrity check of a database created by an old version of the app."""
+import hashlib
+import json
+import sqlite3
+
+import pytest
+
+import integrity
+from storage import SQLiteStorage, open_storage
+
+
+LEGACY_SCHEMA = """
+    CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT, role TEXT);
+    CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, phone TEXT, email TEXT);
+    CREATE TABLE products (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, price REAL, quantity INTEGER DEFAULT 0);
+    CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER, employee_id INTEGER, date TEXT);
+    CREATE TABLE purchases (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, product_id INTEGER);
+    INSERT INTO users (username, password, role) VALUES ('ivan', 'x', 'user');
+    INSERT INTO clients (name) VALUES ('ivan'), ('ghost');
+    INSERT INTO products (name, price, quantity) VALUES ('Молоко', 89.9, 5);
+    -- The old add_product stored the typed text as is
+    INSERT INTO products (name, price, quantity) VALUES ('Сыр', '1 299,90', 1), ('Хлеб', '15,50', 1), ('Соль', 'abc', 1);
+    INSERT INTO orders (client_id, date) VALUES (2, '2099-01-01');
+    INSERT INTO purchases (username, product_id) VALUES ('ivan', 1), ('ivan', 99), ('ghost', 1);
+"""
+
+
+def legacy_db(tmp_path):
+    path = tmp_path / "kursach.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+    return str(path)
+
+
+def digest(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def test_check_reports_orphans_without_writing(tmp_path, capsys):
+    path = legacy_db(tmp_path)
+    before = digest(path)
+    assert integrity.main(["--db", path]) == 1
+    assert digest(path) == before
+    out = capsys.readouterr().out
+    assert "Клиенты без учётной записи: 1" in out
+    assert "Покупки без пользователя: 1" in out
+    assert "Покупки удалённых товаров: 1" in out
+
+
+def test_migration_keeps_orphans_for_repair(tmp_path):
+    path = legacy_db(tmp_path)
+    storage = open_storage(path)
+    try:
+        storage.ensure_schema()
+        assert storage.fetchone("SELECT COUNT(*) FROM purchases")[0] == 3
+        found = storage.check_integrity()
+        assert found["purchases_without_user"] == 1
+        assert found["purchases_without_product"] == 1
+
+        assert storage.check_integrity(repair=True, batch_rows=1) == found
+        assert sum(storage.check_integrity().values()) == 0
+        assert storage.fetchone("SELECT COUNT(*) FROM purchases")[0] == 2
+        repairs = storage.audit_entries(actor="integrity")
+        assert {row[2] for row in repairs} == {"repair_orphans"}
+    finally:
+        storage.close()
+
+
+def test_migration_converts_typed_prices(tmp_path):
+    storage = open_storage(legacy_db(tmp_path))
+    try:
+        storage.ensure_schema()
+        prices = dict(storage.fetchall("SELECT name, price_kop FROM products"))
+        assert prices == {"Молоко": 8990, "Сыр": 129990, "Хлеб": 1550, "Соль": 0}
+        unparsed = storage.audit_entries(actor="migration")
+        assert [(row[2], row[3], json.loads(row[5])) for row in unparsed] == [
+            ("price_unparsed", "product", {"price": "abc"})
+        ]
+    finally:
+        storage.close()
+
+
+def test_interrupted_upgrade_is_redone(tmp_path, monkeypatch):
+    storage = open_storage(legacy_db(tmp_path))
+    try:
+        def interrupted(self, cur):
+            raise RuntimeError("interrupted")
+
+        monkeypatch.setattr(SQLiteStorage, "_migrate_foreign_keys", interrupted)
+        with pytest.raises(RuntimeError):
+            storage.ensure_schema()
+        monkeypatch.undo()
+        storage.ensure_schema()
+        # Only the cards and purchases of the unknown "ghost" stay unlinked
+        assert storage.fetchall("SELECT name FROM clients WHERE user_id IS NULL") == [("ghost",)]
+        assert storage.fetchall("SELECT username FROM purchases WHERE user_id IS NULL") == [("ghost",)]
+        assert storage.fetchone("SELECT price_kop FROM products WHERE name = 'Хлеб'")[0] == 1550
+        assert len(storage.audit_entries(actor="migration")) == 1
+    finally:
+        storage.close()
@@ -0,0 +1,109 @@
+"""Offline journal: a local SQLite queue synced to each central backend."""
+import json
+import sqlite3
+
+import pytest
+
+from journal import OfflineJournal
+from storage import CatalogCache, SQLiteStorage, open_storage
+
+
+@pytest.fixture
+def central(database_url):
+    storage = open_storage(database_url)
+    storage.ensure_schema()
+    storage.ensure_admin()
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = OfflineJournal(str(tmp_path / "journal.db"))
+    yield journal
+    journal.close()
+
+
+def offline_sale(central, journal, quantity=1):
+    assert central.register_user("ivan", "pw", "", "")
+    session = central.authenticate("ivan", "pw")
+    central.add_product("Молоко", 8990, 10, "admin")
+    catalog = CatalogCache(central)
+    catalog.refresh()
+    journal.queue_purchase(session, catalog.products()[0], quantity)
+    return session
+
+
+def test_locked_database_leaves_entries_pending(central, journal):
+    if not isinstance(central, SQLiteStorage) or central.path.startswith("file:"):
+        pytest.skip("holds the write lock of a SQLite file")
+    session = offline_sale(central, journal)
+    journal.queue_registration("petr", "secret", "", "")
+    # Another terminal holds the write lock; this one does not wait for it
+    busy = SQLiteStorage(central.path, pool_size=1, timeout=0)
+    blocker = sqlite3.connect(central.path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        assert journal.sync(busy) == []
+        assert journal.pending_count() == 2
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+        busy.close()
+
+    assert journal.sync(central) == []
+    assert journal.pending_count() == 0
+    assert central.purchase_totals(session.user_id) == (1, 8990)
+    assert central.authenticate("petr", "secret") is not None
+
+
+def test_bad_entry_is_rejected_alone(central, journal):
+    session = offline_sale(central, journal)
+    journal.queue_registration("ivan", "pw", "", "")
+    problems = journal.sync(central)
+    assert [(kind, status) for kind, _, status, _ in problems] == [("register", "rejected")]
+    assert central.purchase_totals(session.user_id) == (1, 8990)
+
+
+def test_synced_registration_forgets_password(central, journal):
+    journal.queue_registration("petr", "secret", "", "")
+    assert journal.sync(central) == []
+    with sqlite3.connect(journal.path) as conn:
+        payload, = conn.execute("SELECT payload FROM queue").fetchone()
+    assert "password" not in json.loads(payload)
+    assert "secret" not in payload
+
+    assert journal.prune(days=1) == 0
+    assert journal.prune(days=-1) == 1
+    assert journal.pending_count() == 0
+
+
+def test_stock_conflicts_and_resent_batch(central, journal):
+    assert central.register_user("ivan", "pw", "", "")
+    session = central.authenticate("ivan", "pw")
+    central.add_product("Молоко", 8990, 3, "admin")
+    catalog = CatalogCache(central)
+    catalog.refresh()
+    milk = catalog.products()[0]
+    # Three terminals' worth of sales against the same 3 units
+    for _ in range(3):
+        journal.queue_purchase(session, milk, 2)
+
+    problems = journal.sync(central)
+    assert [(status, message) for _, _, status, message in problems] == [
+        ("partial", "Продано 1 из 2."),
+        ("rejected", "Товар закончился."),
+    ]
+    assert central.list_products()[0][3] == 0
+    assert central.purchase_totals(session.user_id) == (3, 3 * 8990)
+
+    # The reply was lost and the same batch arrives again: nothing changes
+    with sqlite3.connect(journal.path) as conn:
+        entries = [(op_id, kind, json.loads(payload))
+                   for op_id, kind, payload in conn.execute("SELECT op_id, kind, payload FROM queue ORDER BY id")]
+    assert central.apply_offline_batch(entries) == [
+        ("done", None), ("partial", "Продано 1 из 2."), ("rejected", "Товар закончился.")
+    ]
+    assert central.list_products()[0][3] == 0
+    assert central.purchase_totals(session.user_id) == (3, 3 * 8990)
+    assert len(central.list_orders()) == 2
@@ -0,0 +1,23 @@
+import pytest
+
+from money import MAX_PRICE_RUB, parse_price
+
+
+@pytest.mark.parametrize("text, kopecks", [
+    ("15.5", 1550),
+    ("15,50", 1550),
+    ("1 299,90", 129990),
+    ("1 299,90 ₽", 129990),
+    ("10.500", 1050),
+    ("100", 10000),
+    ("0", 0),
+    (str(MAX_PRICE_RUB), MAX_PRICE_RUB * 100),
+])
+def test_parse_price(text, kopecks):
+    assert parse_price(text) == kopecks
+
+
+@pytest.mark.parametrize("text", ["", "abc", "-1", "10.505", "1e20", "NaN", "Infinity", str(MAX_PRICE_RUB + 1)])
+def test_parse_price_rejects(text):
+    with pytest.raises(ValueError):
+        parse_price(text)
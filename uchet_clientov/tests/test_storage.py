@@ -0,0 +1,299 @@
+"""Storage contract: every backend must pass the same tests."""
+import json
+import threading
+from datetime import date
+
+import pytest
+
+from storage import CatalogCache, PurchaseError, SQLiteStorage, StorageError
+
+
+def register(storage, username, password="pw"):
+    assert storage.register_user(username, password, "+70000000000", f"{username}@example.com")
+    return storage.authenticate(username, password)
+
+
+def add_product(storage, name="Молоко", price_kop=8990, quantity=10, threshold=0):
+    storage.add_product(name, price_kop, quantity, "admin", threshold)
+    return next(row[0] for row in storage.list_products() if row[1] == name)
+
+
+def test_register_and_authenticate(storage):
+    session = register(storage, "ivan")
+    assert session.username == "ivan"
+    assert session.role == "user" and not session.is_admin
+    assert session.client_id is not None
+    assert storage.authenticate("ivan", "wrong") is None
+    assert storage.authenticate("admin", "admin123").is_admin
+    # Usernames are unique
+    assert not storage.register_user("ivan", "other", "", "")
+    clients = {row[2]: row for row in storage.list_clients()}
+    assert clients["ivan"][0] == session.user_id
+    assert clients["ivan"][1] == session.client_id
+    assert "admin" not in clients
+
+
+def test_buy_takes_stock_and_records_ledger(storage):
+    session = register(storage, "ivan")
+    pid = add_product(storage, quantity=5)
+    storage.buy_product(session, pid, 3)
+    assert storage.list_products()[0][3] == 2
+    assert storage.purchase_totals(session.user_id) == (3, 3 * 8990)
+    assert len(storage.list_orders()) == 1
+    with pytest.raises(PurchaseError):
+        storage.buy_product(session, pid, 3)
+    with pytest.raises(PurchaseError):
+        storage.buy_product(session, pid + 1000, 1)
+    # A rejected purchase changes nothing
+    assert storage.list_products()[0][3] == 2
+    assert storage.purchase_totals(session.user_id) == (3, 3 * 8990)
+
+
+def test_sold_out_product_stays_in_catalog(storage):
+    session = register(storage, "ivan")
+    pid = add_product(storage, quantity=1, threshold=1)
+    storage.buy_product(session, pid, 1)
+    assert [row[0] for row in storage.list_products()] == [pid]
+    assert storage.list_products(in_stock_only=True) == []
+    assert [row[0] for row in storage.low_stock_products()] == [pid]
+
+
+def test_concurrent_buyers_never_oversell(storage):
+    sessions = [register(storage, f"user{i}") for i in range(8)]
+    pid = add_product(storage, quantity=20)
+    sold, errors = [], []
+    lock = threading.Lock()
+
+    def buyer(session):
+        for _ in range(5):
+            try:
+                storage.buy_product(session, pid, 1)
+            except PurchaseError:
+                continue
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                sold.append(session.user_id)
+
+    threads = [threading.Thread(target=buyer, args=(s,)) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(sold) == 20
+    assert storage.list_products()[0][3] == 0
+    assert storage.fetchone("SELECT COUNT(*) FROM purchases")[0] == 20
+
+
+def test_purchase_paging_and_totals(storage):
+    session = register(storage, "ivan")
+    other = register(storage, "petr")
+    pid = add_product(storage, price_kop=100, quantity=100)
+    storage.buy_product(session, pid, 7)
+    storage.buy_product(other, pid, 2)
+
+    pages, cursor = [], None
+    while True:
+        rows = storage.purchase_page(session.user_id, cursor, 3)
+        if not rows:
+            break
+        pages.append(rows)
+        cursor = rows[-1][0]
+    assert [len(p) for p in pages] == [3, 3, 1]
+    ids = [row[0] for page in pages for row in page]
+    assert ids == sorted(ids, reverse=True)
+    assert all(row[1:] == ("Молоко", 100) for page in pages for row in page)
+    assert storage.purchase_totals(session.user_id) == (7, 700)
+    assert storage.purchase_totals(other.user_id) == (2, 200)
+
+
+def test_deleting_user_cascades(storage):
+    session = register(storage, "ivan")
+    keep = register(storage, "petr")
+    pid = add_product(storage)
+    storage.buy_product(session, pid, 2)
+    storage.buy_product(keep, pid, 1)
+    storage.add_order(session.client_id, "2099-01-01", "admin")
+
+    assert storage.delete_user(session.user_id, "admin") == "ivan"
+    assert storage.authenticate("ivan", "pw") is None
+    assert [row[2] for row in storage.list_clients()] == ["petr"]
+    assert storage.purchase_totals(session.user_id) == (0, 0)
+    assert storage.purchase_totals(keep.user_id) == (1, 8990)
+    assert [row[1] for row in storage.list_orders()] == ["petr"]
+    assert storage.check_integrity() == dict.fromkeys(storage.check_integrity(), 0)
+
+    admin = storage.authenticate("admin", "admin123")
+    with pytest.raises(StorageError):
+        storage.delete_user(admin.user_id, "admin")
+
+
+def test_deleting_product_keeps_purchases(storage):
+    session = register(storage, "ivan")
+    pid = add_product(storage)
+    storage.buy_product(session, pid, 2)
+    storage.delete_product(pid, "admin")
+    assert storage.list_products() == []
+    assert storage.purchase_totals(session.user_id) == (2, 2 * 8990)
+    assert [row[1] for row in storage.purchase_page(session.user_id, None, 10)] == [None, None]
+
+
+def test_order_needs_existing_client(storage):
+    with pytest.raises(Exception):
+        storage.add_order(12345, "2099-01-01", "admin")
+    assert storage.list_orders() == []
+
+
+def test_audit_log(storage):
+    session = register(storage, "ivan")
+    pid = add_product(storage, quantity=5)
+    storage.buy_product(session, pid, 2)
+    storage.restock_product(pid, 10, "admin")
+
+    actions = [row[2] for row in storage.audit_entries()]
+    assert sorted(actions) == ["add_client", "add_product", "buy_product", "restock"]
+    mine = storage.audit_entries(actor="ivan")
+    assert sorted(row[2] for row in mine) == ["add_client", "buy_product"]
+    buy = next(row for row in mine if row[2] == "buy_product")
+    assert buy[3:5] == ("product", pid)
+    assert json.loads(buy[5]) == {"quantity": 2, "price_kop": 8990}
+    assert storage.audit_entries(date_to="2000-01-31") == []
+    today = date.today()
+    assert len(storage.audit_entries(date_from=f"{today.year}-{today.month}-1")) == 4
+    for bad in ("01.10.2026", "2026-13-01"):
+        with pytest.raises(ValueError):
+            storage.audit_entries(date_from=bad)
+
+
+def test_audit_log_is_append_only(storage):
+    register(storage, "ivan")
+    with storage.transaction() as cur:
+        table = storage._list_audit_tables(cur)[0]
+    for sql in (f"UPDATE {table} SET actor = 'x'", f"DELETE FROM {table}"):
+        with pytest.raises(Exception):
+            with storage.transaction() as cur:
+                storage.execute(cur, sql)
+    assert len(storage.audit_entries()) == 1
+
+
+def test_audit_log_sees_other_terminals(storage, open_terminal):
+    assert storage.audit_entries() == []
+    terminal = open_terminal()
+    terminal.register_user("ivan", "pw", "", "")
+    assert [row[1] for row in storage.audit_entries()] == ["ivan"]
+
+
+def test_audit_view_keeps_months_created_elsewhere(storage, open_terminal):
+    register(storage, "ivan")
+    terminal = open_terminal()
+    # Another process rolls over into a month this one has not seen
+    with terminal.transaction() as cur:
+        terminal._audit_table(cur, "2000-01")
+    with storage.transaction() as cur:
+        storage._audit_table(cur, "2000-02")
+        tables = storage._list_audit_tables(cur)
+        view = storage.execute(cur, "SELECT COUNT(*) FROM audit_log").fetchone()[0]
+    assert {"audit_log_200001", "audit_log_200002"} <= set(tables)
+    assert view == 1
+    # Every month is in the view, not only the ones this process created
+    with storage.transaction() as cur:
+        for table in tables:
+            storage.execute(cur, f"INSERT INTO {table} (ts, actor, action) VALUES (?, ?, ?)",
+                            (f"{table[-6:-2]}-{table[-2:]}-01 00:00:00", "x", "probe"))
+        probed = storage.execute(cur, "SELECT COUNT(*) FROM audit_log WHERE action = 'probe'").fetchone()[0]
+    assert probed == len(tables)
+
+
+def test_data_version_ignores_non_catalog_writes(storage):
+    session = register(storage, "ivan")
+    add_product(storage)
+    catalog = CatalogCache(storage)
+    catalog.refresh()
+    before = storage.data_version()
+    register(storage, "petr")
+    storage.add_order(session.client_id, "2099-01-01", "admin")
+    storage.cleanup_expired_orders()
+    storage.audit_entries()
+    assert storage.data_version()[0] == before[0]
+    if isinstance(storage, SQLiteStorage):
+        assert storage.data_version() == before
+    # PostgreSQL's stock marker is a snapshot and moves with any commit,
+    # but the re-read finds nothing new
+    assert not catalog.refresh()
+
+
+def test_catalog_cache_rereads_only_changed_stock(storage, open_terminal):
+    session = register(storage, "ivan")
+    milk = add_product(storage, "Молоко", quantity=5)
+    bread = add_product(storage, "Хлеб", quantity=5)
+    terminal = open_terminal()
+    catalog = CatalogCache(terminal)
+    assert catalog.refresh() and catalog.last_changed is None
+    assert not catalog.refresh()
+
+    storage.buy_product(session, milk, 2)
+    catalog_version, _ = storage.data_version()
+    assert catalog.refresh()
+    assert [p.id for p in catalog.last_changed] == [milk]
+    assert catalog.get(milk).quantity == 3 and catalog.get(bread).quantity == 5
+    # Purchases leave the admin catalog counter alone
+    assert storage.data_version()[0] == catalog_version
+
+    storage.restock_product(bread, 10, "admin")
+    assert catalog.refresh()
+    assert [p.id for p in catalog.last_changed] == [bread]
+    assert catalog.get(bread).quantity == 15
+
+    storage.delete_product(milk, "admin")
+    assert catalog.refresh() and catalog.last_changed is None
+    assert [p.id for p in catalog.products()] == [bread]
+
+
+def test_buying_after_user_was_deleted(storage):
+    session = register(storage, "ivan")
+    pid = add_product(storage, quantity=5)
+    storage.delete_user(session.user_id, "admin")
+    with pytest.raises(PurchaseError):
+        storage.buy_product(session, pid, 1)
+    assert storage.list_products()[0][3] == 5
+    assert storage.purchase_totals(session.user_id) == (0, 0)
+
+
+def test_catalog_cache_sees_writers_commit_out_of_order(storage, open_terminal):
+    if isinstance(storage, SQLiteStorage):
+        pytest.skip("SQLite has one writer at a time: versions follow commit order")
+    milk = add_product(storage, "Молоко", quantity=5)
+    bread = add_product(storage, "Хлеб", quantity=5)
+    terminal = open_terminal()
+    catalog = CatalogCache(storage)
+    catalog.refresh()
+    with terminal.transaction() as cur:
+        # Takes its stock version first and commits last
+        terminal.execute(
+            cur,
+            f"UPDATE products SET quantity = quantity + 10, stock_version = {terminal.next_stock_version} WHERE id = ?",
+            (milk,)
+        )
+        storage.restock_product(bread, 1, "admin")
+        assert catalog.refresh()
+        assert [p.id for p in catalog.last_changed] == [bread]
+        assert catalog.get(milk).quantity == 5
+    assert catalog.refresh()
+    assert [p.id for p in catalog.last_changed] == [milk]
+    assert catalog.get(milk).quantity == 15
+    assert not catalog.refresh()
+
+
+def test_online_purchase_is_not_replayed_twice(storage):
+    session = register(storage, "ivan")
+    pid = add_product(storage, quantity=5)
+    # The sale commits, but the terminal only sees the link drop and queues it
+    storage.buy_product(session, pid, 2, "op-1")
+    payload = {"user_id": session.user_id, "client_id": session.client_id, "username": "ivan",
+               "product_id": pid, "quantity": 2, "price_kop": 8990, "queued_at": "2099-01-01 00:00:00"}
+    assert storage.apply_offline_batch([("op-1", "purchase", payload)]) == [("done", None)]
+    assert storage.list_products()[0][3] == 3
+    assert storage.purchase_totals(session.user_id) == (2, 2 * 8990)